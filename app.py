@@ -1,23 +1,30 @@
 # basic imports
 import os
 import json
+import asyncio
+import itertools
 import logging
 import logging_config as lc
 
 # api imports
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, AsyncExitStack
 from fastapi import FastAPI, HTTPException, Request, Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, ConfigDict, Field
 from typing import Union
 import urllib
+import anyio
 
 # import other py's from this repository
 import local_query_executor
 import request_processor
 import knowledge_network
 import ttp_client
+import result_writer
+import metrics
+from cache import LRUCache
 
 ####################
 # ENABLING LOGGING #
@@ -26,6 +33,7 @@ import ttp_client
 logger = logging.getLogger(__name__)
 logger.setLevel(lc.LOG_LEVEL)
 logger.info(f"LOG_LEVEL is set to {logging.getLevelName(logger.level)}")
+payload_logger = lc.getPayloadLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 
 
@@ -58,6 +66,74 @@ if "TOKEN_ENABLED" in os.environ:
 else: # no token_enabled flag, so set the flag to false
     TOKEN_ENABLED = False
 
+if "PREREGISTER_KNOWLEDGE_BASES" in os.environ:
+    PREREGISTER_KNOWLEDGE_BASES = os.getenv("PREREGISTER_KNOWLEDGE_BASES")
+    match PREREGISTER_KNOWLEDGE_BASES:
+        case "True":
+            PREREGISTER_KNOWLEDGE_BASES = True
+        case "False":
+            PREREGISTER_KNOWLEDGE_BASES = False
+        case _:
+            raise Exception("Incorrect PREREGISTER_KNOWLEDGE_BASES flag => You should provide a correct PREREGISTER_KNOWLEDGE_BASES flag that is either True or False!")
+else: # no preregister flag, so register the knowledge bases upon the first request of each requester
+    PREREGISTER_KNOWLEDGE_BASES = False
+logger.info(f"PREREGISTER_KNOWLEDGE_BASES is set to {PREREGISTER_KNOWLEDGE_BASES}")
+
+if "MAX_CONCURRENT_REQUESTS" in os.environ:
+    try:
+        MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS"))
+    except ValueError:
+        raise Exception("Incorrect MAX_CONCURRENT_REQUESTS => You should provide a positive integer in the environment variable MAX_CONCURRENT_REQUESTS")
+    if MAX_CONCURRENT_REQUESTS < 1:
+        raise Exception("Incorrect MAX_CONCURRENT_REQUESTS => You should provide a positive integer in the environment variable MAX_CONCURRENT_REQUESTS")
+else: # no maximum, so allow 40 requests to be processed at the same time
+    MAX_CONCURRENT_REQUESTS = 40
+logger.info(f"MAX_CONCURRENT_REQUESTS is set to {MAX_CONCURRENT_REQUESTS}")
+
+if "RESULT_CACHE_TTL" in os.environ:
+    try:
+        RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL"))
+    except ValueError:
+        raise Exception("Incorrect RESULT_CACHE_TTL => You should provide a non-negative number of seconds (0 disables the cache) in the environment variable RESULT_CACHE_TTL")
+    if RESULT_CACHE_TTL < 0:
+        raise Exception("Incorrect RESULT_CACHE_TTL => You should provide a non-negative number of seconds (0 disables the cache) in the environment variable RESULT_CACHE_TTL")
+else: # no time-to-live, so responses are not cached
+    RESULT_CACHE_TTL = 0
+logger.info(f"RESULT_CACHE_TTL is set to {RESULT_CACHE_TTL}")
+
+if "RESULT_CACHE_SIZE" in os.environ:
+    try:
+        RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE"))
+    except ValueError:
+        raise Exception("Incorrect RESULT_CACHE_SIZE => You should provide a positive integer in the environment variable RESULT_CACHE_SIZE")
+    if RESULT_CACHE_SIZE < 1:
+        raise Exception("Incorrect RESULT_CACHE_SIZE => You should provide a positive integer in the environment variable RESULT_CACHE_SIZE")
+else: # no cache size, so keep at most 1024 responses
+    RESULT_CACHE_SIZE = 1024
+logger.info(f"RESULT_CACHE_SIZE is set to {RESULT_CACHE_SIZE}")
+
+if "RESULT_CACHE_MAX_BYTES" in os.environ:
+    try:
+        RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES"))
+    except ValueError:
+        raise Exception("Incorrect RESULT_CACHE_MAX_BYTES => You should provide a positive integer in the environment variable RESULT_CACHE_MAX_BYTES")
+    if RESULT_CACHE_MAX_BYTES < 1:
+        raise Exception("Incorrect RESULT_CACHE_MAX_BYTES => You should provide a positive integer in the environment variable RESULT_CACHE_MAX_BYTES")
+else: # no maximum, so keep at most 64 MB of responses
+    RESULT_CACHE_MAX_BYTES = 64*1024*1024
+logger.info(f"RESULT_CACHE_MAX_BYTES is set to {RESULT_CACHE_MAX_BYTES}")
+
+if "STREAMING_RESPONSE_MIN_ROWS" in os.environ:
+    try:
+        STREAMING_RESPONSE_MIN_ROWS = int(os.getenv("STREAMING_RESPONSE_MIN_ROWS"))
+    except ValueError:
+        raise Exception("Incorrect STREAMING_RESPONSE_MIN_ROWS => You should provide a positive integer in the environment variable STREAMING_RESPONSE_MIN_ROWS")
+    if STREAMING_RESPONSE_MIN_ROWS < 1:
+        raise Exception("Incorrect STREAMING_RESPONSE_MIN_ROWS => You should provide a positive integer in the environment variable STREAMING_RESPONSE_MIN_ROWS")
+else: # no minimum, so stream results with 10000 or more bindings
+    STREAMING_RESPONSE_MIN_ROWS = 10000
+logger.info(f"STREAMING_RESPONSE_MIN_ROWS is set to {STREAMING_RESPONSE_MIN_ROWS}")
+
 
 ####################
 #  OPENAPI EXTRAS  #
@@ -238,22 +314,50 @@ class SPARQLSelectWithGapsResponse(BaseModel):
 # START PROCESS LIFESPAN #
 ##########################
 
+async def start_up():
+    await knowledge_network.waitUntilKnowledgeNetworkIsReady()
+    # register the knowledge bases of all requesters in the tokens file, when requested
+    if PREREGISTER_KNOWLEDGE_BASES:
+        await knowledge_network.preregisterKnowledgeBases(ttp_client.get_requester_ids())
+    logger.info("--- Knowledge Engine SPARQL Endpoint is ready ---")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # code to execute upon starting the API
     logger.info("--- Knowledge Engine SPARQL Endpoint is starting ---")
+    # connect to the knowledge network in the background, so that the endpoint starts without waiting for it
+    startup_task = asyncio.create_task(start_up())
+    # unregister the knowledge bases of requesters that are idle for too long
+    if knowledge_network.KNOWLEDGE_BASE_IDLE_TIMEOUT > 0:
+        eviction_task = asyncio.create_task(knowledge_network.evictIdleKnowledgeBases())
     
     yield
     # code to execute upon stopping the API
     logger.info("--- Knowledge Engine SPARQL Endpoint is stopping because yield has entered ---")
+    startup_task.cancel()
+    if knowledge_network.KNOWLEDGE_BASE_IDLE_TIMEOUT > 0:
+        eviction_task.cancel()
     # unregister all knowledge bases!!
-    knowledge_network.unregisterKnowledgeBases()
+    await knowledge_network.unregisterKnowledgeBases()
 
 
 #########################
 # GENERIC START-UP CODE #
 #########################
 
+# the query and update pipelines wait on the knowledge network without blocking the event loop, but the number of
+# requests that are processed at the same time is bounded to protect the endpoint and the knowledge network
+request_limiter = anyio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+# start an empty cache with a mapping between (requester_id, query, gaps_enabled) and serialized responses
+result_cache = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, max_weight=RESULT_CACHE_MAX_BYTES, weigh=len)
+
+# export the statistics of the caches together with the other metrics
+metrics.registerCache("query_cache", request_processor.getQueryCacheStatistics)
+metrics.registerCache("result_cache", result_cache.stats)
+metrics.registerCache("knowledge_base_registry", knowledge_network.knowledge_bases.stats)
+
 # generate a FastAPI application
 app = FastAPI(title=f"{SPARQL_ENDPOINT_NAME} SPARQL Endpoint",
               description="""This SPARQL Endpoint is a generic component that takes a SPARQL 1.1 query as input, 
@@ -291,6 +395,20 @@ async def root():
     return "App is running, see /docs for Swagger Docs."
 
 
+@app.get('/ready', description="Readiness check, which succeeds once the knowledge network answers", tags=["Connection Test"])
+async def ready():
+    if knowledge_network.knowledge_network_ready or await knowledge_network.probeKnowledgeNetwork():
+        return "App is ready."
+    raise HTTPException(status_code=503,
+                        detail=f"The endpoint is not ready, because the knowledge network at {knowledge_network.KNOWLEDGE_ENGINE_URL} does not answer!")
+
+
+@app.get('/metrics', description="Metrics in the Prometheus text format, such as the duration of the stages of handling requests", tags=["Monitoring"])
+async def get_metrics():
+    content, media_type = metrics.getMetrics()
+    return Response(content=content, media_type=media_type)
+
+
 # see the docs for examples how to use this route
 @app.get('/query/',
          tags=["SPARQL query execution"], 
@@ -305,6 +423,8 @@ async def root():
              The operation will fire the query onto the knowledge network that is provided to the SPARQL endpoint and
              returns bindings for the query in JSON format according to the 
              [SPARQL 1.1 Query Results specification](https://www.w3.org/TR/2013/REC-sparql11-results-json-20130321/).
+             Depending on the 'Accept' header, the bindings are returned in the 
+             [CSV or TSV](https://www.w3.org/TR/sparql11-results-csv-tsv/) or [XML](https://www.w3.org/TR/rdf-sparql-XMLres/) format instead.
         """,
         openapi_extra = OPENAPI_EXTRA_GET_REQUEST
         )
@@ -327,7 +447,7 @@ async def get(request: Request):
     # then get the requester_id and query string
     requester_id, query = process_request_message_and_get_request_and_query(request, query)
 
-    return handle_query(requester_id, query, False)
+    return await handle_limited_query(requester_id, query, False, get_cache_mode(request), get_result_format(request), is_profile_requested(request))
 
 
 # see the docs for examples how to use this route
@@ -346,6 +466,8 @@ async def get(request: Request):
               The operation will fire the query onto the knowledge network that is provided to the SPARQL endpoint and
               returns bindings for the query in JSON format according to the 
               [SPARQL 1.1 Query Results specification](https://www.w3.org/TR/2013/REC-sparql11-results-json-20130321/).
+              Depending on the 'Accept' header, the bindings are returned in the 
+              [CSV or TSV](https://www.w3.org/TR/sparql11-results-csv-tsv/) or [XML](https://www.w3.org/TR/rdf-sparql-XMLres/) format instead.
           """,
           openapi_extra = OPENAPI_EXTRA_POST_REQUEST
         )
@@ -356,7 +478,7 @@ async def post(request: Request):
     # then get the requester_id and query string
     requester_id, query = process_request_message_and_get_request_and_query(request, query)
 
-    return handle_query(requester_id, query, False)
+    return await handle_limited_query(requester_id, query, False, get_cache_mode(request), get_result_format(request), is_profile_requested(request))
 
 
 # see the docs for examples how to use this route
@@ -389,7 +511,7 @@ async def post(request: Request):
     # then get the requester_id and query string
     requester_id, query = process_request_message_and_get_request_and_query(request, query)
 
-    return handle_query(requester_id, query, True)
+    return await handle_limited_query(requester_id, query, True, get_cache_mode(request), get_result_format(request), is_profile_requested(request))
 
 
 # see the docs for examples how to use this route
@@ -416,7 +538,9 @@ async def post(request: Request):
     # then get the requester_id and update request string
     requester_id, update = process_request_message_and_get_request_and_query(request, update)
 
-    return handle_update(requester_id, update, False)
+    async with request_limiter:
+        with metrics.measureStage("update"):
+            return await handle_update(requester_id, update, False)
 
 
 ####################
@@ -437,14 +561,24 @@ def process_request_message_and_get_request_and_query(request: Request, query: s
                             detail=f"Unauthorized: {e}")
     logger.info(f"Received {request.method} request from '{requester_id}' via route /{route}/!")
 
-    # then, do "content negotiation" only for the 'query' route, by checking the accept header provided by the client
-    if route.startswith('query') and 'accept' in request.headers.keys():
+    # then, do "content negotiation" only for the 'query' routes, by checking the accept header provided by the client
+    if route.startswith('query') and get_result_format(request) is None:
         accept_header = request.headers.get('Accept')
-        if "application/json" not in accept_header and "application/sparql-results+json" not in accept_header:
-            logger.debug(f"Accept header is: {accept_header}")
+        logger.debug(f"Accept header is: {accept_header}")
+        if route.startswith('query-with-gaps'):
+            # the knowledge gaps can only be returned in the JSON output
             logger.debug("Precondition Failed: When you provide the 'Accept' header, it should contain 'application/json' or 'application/sparql-results+json' as the endpoint only returns JSON output!")
             raise HTTPException(status_code=412,
                                 detail="When you provide the 'Accept' header, it should contain 'application/json' or 'application/sparql-results+json' as the endpoint only returns JSON output!")
+        logger.debug("Precondition Failed: When you provide the 'Accept' header, it should contain 'application/json', 'application/sparql-results+json', 'text/csv', 'text/tab-separated-values' or 'application/sparql-results+xml'!")
+        raise HTTPException(status_code=412,
+                            detail="When you provide the 'Accept' header, it should contain 'application/json', 'application/sparql-results+json', 'text/csv', 'text/tab-separated-values' or 'application/sparql-results+xml'!")
+
+    # the profile of a query is returned next to the results, which is only possible in the JSON output
+    if route.startswith('query') and is_profile_requested(request) and get_result_format(request) != "json":
+        logger.debug("Bad Request: You can only ask for the profile of a query with 'profile=true' when the result is returned in JSON!")
+        raise HTTPException(status_code=400,
+                            detail="You can only ask for the profile of a query with 'profile=true' when the result is returned in JSON!")
 
     # then, deal with the various GET and POST operations
     if request.method == "GET":
@@ -479,11 +613,11 @@ def process_request_message_and_get_request_and_query(request: Request, query: s
             if route.startswith('query'):
                 # the body should contain a parameter "query" with a URL-encoded query, optionally ampersand separated with other parameters, or
                 try:
-                    logger.info(f"Raw query received is: {query}")
+                    payload_logger.debug("Raw query received is: %s", lc.Payload(query))
                     parameters = query.decode().split("&")
-                    logger.debug(f"Parameters are: {parameters}")
+                    payload_logger.debug("Parameters are: %s", lc.Payload(parameters))
                     parameter_list = {p.split("=",1)[0] : p.split("=",1)[1] for p in parameters}
-                    logger.debug(f"parameter_list is: {parameter_list}")
+                    payload_logger.debug("parameter_list is: %s", lc.Payload(parameter_list))
                     query = parameter_list['query']
                 except:
                     logger.debug("Bad Request: You must provide a URL-encoded body parameter called 'query' that contains the SPARQL query!")
@@ -499,11 +633,11 @@ def process_request_message_and_get_request_and_query(request: Request, query: s
             elif route == 'update':
                 # the body should contain a parameter "update" with a URL-encoded update, optionally ampersand separated with other parameters.
                 try:
-                    logger.info(f"Raw query received is: {query}")
+                    payload_logger.debug("Raw query received is: %s", lc.Payload(query))
                     parameters = query.decode().split("&")
-                    logger.debug(f"Parameters are: {parameters}")
+                    payload_logger.debug("Parameters are: %s", lc.Payload(parameters))
                     parameter_list = {p.split("=",1)[0] : p.split("=",1)[1] for p in parameters}
-                    logger.debug(f"parameter_list is: {parameter_list}")
+                    payload_logger.debug("parameter_list is: %s", lc.Payload(parameter_list))
                     query = parameter_list['update']
                 except:
                     logger.debug("Bad Request: You must provide a URL-encoded body parameter called 'update' that contains the SPARQL update request!")
@@ -523,23 +657,102 @@ def process_request_message_and_get_request_and_query(request: Request, query: s
             raise HTTPException(status_code=415,
                                 detail="The Content-Type must either be 'application/sparql-query', 'application/sparql-update' or 'application/x-www-form-urlencoded'")
 
-    logger.info(f"SPARQL Query is: {query}")
+    payload_logger.debug("SPARQL Query is: %s", lc.Payload(query))
 
     return requester_id, query
 
 
-def handle_query(requester_id: str, query: str, gaps_enabled) -> dict:
+def get_result_format(request: Request) -> str | None:
+    # the format of the result is negotiated with the accept header, the knowledge gaps can only be returned in JSON
+    if 'accept' not in request.headers.keys():
+        return "json"
+    formats = list(result_writer.RESULT_FORMATS.keys())
+    if request.url.path.strip('/').startswith('query-with-gaps'):
+        formats = ["json"]
+    return result_writer.negotiateResultFormat(request.headers.get('Accept'), formats)
+
+
+def is_profile_requested(request: Request) -> bool:
+    # a client can ask for the execution trace of a query with the 'profile=true' query parameter
+    return request.query_params.get('profile', "false").lower() == "true"
+
+
+def get_cache_mode(request: Request) -> str:
+    # a client can refresh the cached response with the 'Cache-Control: no-cache' header,
+    # or bypass the result cache altogether with the 'Cache-Control: no-store' header
+    cache_control = request.headers.get('Cache-Control', "").lower()
+    if "no-store" in cache_control:
+        return "bypass"
+    if "no-cache" in cache_control:
+        return "refresh"
+    return "use"
+
+
+async def handle_limited_query(*args) -> Response:
+    # the request limiter is held and the query stage is measured until the response has been written,
+    # so for a streamed response they are only released once the stream has finished
+    stack = AsyncExitStack()
+    await stack.enter_async_context(request_limiter)
+    stack.enter_context(metrics.measureStage("query"))
+    try:
+        response = await handle_query(*args)
+    except BaseException:
+        await stack.aclose()
+        raise
+    if isinstance(response, StreamingResponse):
+        # the stream releases them when it ends or fails, and the background task when the stream is never started
+        response.body_iterator = release_after_stream(response.body_iterator, stack)
+        response.background = BackgroundTask(stack.aclose)
+    else:
+        await stack.aclose()
+    return response
+
+
+async def release_after_stream(chunks, stack: AsyncExitStack):
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await stack.aclose()
+
+
+async def handle_query(requester_id: str, query: str, gaps_enabled, cache_mode: str = "use", result_format: str = "json", profile: bool = False) -> dict:
+    # when requested, trace the execution of the query to return it as profile in a JSON result
+    trace = None
+    if profile:
+        trace = metrics.startTrace()
+
+    # when enabled, return the cached response if the requester recently sent the same query
+    cache_key = (requester_id, request_processor.normalizeQueryText(query), gaps_enabled, result_format)
+    media_type = result_writer.getMediaType(result_format)
+    if RESULT_CACHE_TTL > 0 and cache_mode == "use" and trace is None:
+        cached_response = result_cache.get(cache_key)
+        if cached_response is not None:
+            logger.info(f"SPARQL Endpoint returns the cached response to the query!")
+            metrics.RESPONSE_BYTES.labels(result_format).inc(len(cached_response))
+            return Response(content=cached_response, media_type=media_type)
+
     # check whether the requester's knowledge base already exists, if not create it
     try:
-        knowledge_network.check_knowledge_base_existence(requester_id)
+        with metrics.measureStage("knowledge_base_existence"):
+            await knowledge_network.check_knowledge_base_existence(requester_id)
     except Exception as e:
         logger.debug(f"An unexpected error in requester knowledge base occurred: {e}")
         raise HTTPException(status_code=500,
                             detail=f"An unexpected error in requester knowledge base occurred: {e}")
 
-    # take the query and build a graph with bindings from the knowledge network needed to satisfy the query
+    # take the query, parse it once and build a graph with bindings from the knowledge network needed to satisfy the query
+    # or, when the bindings already are the answer to the query, only get the bindings from the knowledge network
     try:
-        graph, knowledge_gaps = request_processor.constructGraphFromKnowledgeNetwork(query, requester_id, gaps_enabled)
+        prepared_query = request_processor.prepareQuery(query)
+        if trace is not None:
+            trace["decomposition"] = request_processor.describeRequestDecomposition(prepared_query.decomposition, prepared_query.namespace_manager)
+        if prepared_query.direct_result is not None:
+            bindings, knowledge_gaps = await request_processor.askBindingsFromKnowledgeNetwork(prepared_query, requester_id, gaps_enabled)
+        else:
+            graph, knowledge_gaps = await request_processor.constructGraphFromKnowledgeNetwork(prepared_query, requester_id, gaps_enabled)
+            if trace is not None:
+                trace["graph_triples"] = len(graph)
     except Exception as e:
         logger.debug(f"Query could not be processed by the endpoint: {e}")
         raise HTTPException(status_code=400,
@@ -549,26 +762,72 @@ def handle_query(requester_id: str, query: str, gaps_enabled) -> dict:
 
     # execute the query on the graph with the retrieved bindings
     try:
-        result = local_query_executor.executeQuery(graph, query)
+        # the evaluation on the local graph is CPU-bound, so run it in a worker thread to keep the event loop responsive
+        with metrics.measureStage("local_evaluation"):
+            if prepared_query.direct_result is not None:
+                result = await anyio.to_thread.run_sync(execute_direct_query, bindings, prepared_query.direct_result)
+            else:
+                result = await anyio.to_thread.run_sync(execute_prepared_query, graph, prepared_query)
         # add knowledge gaps when enabled for a SELECT query
         if gaps_enabled and 'results' in result.keys():
             result['knowledge_gaps'] = knowledge_gaps
             if knowledge_gaps: #bindings should be empty
                 result['results']['bindings'] = [{}]
+        # add the trace of the execution when requested
+        if trace is not None:
+            result['profile'] = trace
     except Exception as e:
         logger.debug(f"Query could not be executed on the local graph: {e}")
         raise HTTPException(status_code=500,
                             detail=f"Query could not be executed on the local graph: {e}")
         
-    logger.info(f"SPARQL Endpoint generated the following result to the query {result}!")
-
+    # large results are streamed binding by binding without validating them against the response model
+    metrics.countResultBindings(result)
+    if not isinstance(result.get('results',{}).get('bindings',[]), list):
+        logger.info(f"SPARQL Endpoint streams a result of at least {STREAMING_RESPONSE_MIN_ROWS} bindings to the query!")
+        return StreamingResponse(metrics.countResponseBytes(result_writer.writeResult(result, result_format), result_format), media_type=media_type)
+
+    logger.info(f"SPARQL Endpoint generated the result to the query!")
+    payload_logger.debug("SPARQL Endpoint generated the following result to the query: %s", lc.Payload(result))
+
+    # the result is serialized at once instead of being validated against the response model of the route,
+    # which is only used for the documentation. when enabled, the serialized response replaces any older
+    # cached response to the same query
+    with metrics.measureStage("serialization"):
+        content = b"".join(metrics.countResponseBytes(result_writer.writeResult(result, result_format), result_format))
+    if RESULT_CACHE_TTL > 0 and cache_mode != "bypass" and trace is None:
+        result_cache.put(cache_key, content, replace=True)
+    return Response(content=content, media_type=media_type)
+
+
+def execute_prepared_query(graph, prepared_query: request_processor.PreparedQuery) -> dict:
+    # a prepared query can be shared by requests via the query cache, so evaluate it under its lock
+    with prepared_query.evaluation_lock:
+        result = local_query_executor.executeQuery(graph, prepared_query.query, lazy=True)
+    return collect_bindings(result)
+
+
+def execute_direct_query(bindings: list, direct_result: request_processor.DirectResult) -> dict:
+    result = local_query_executor.executeDirectQuery(bindings, direct_result.vars, direct_result.distinct, direct_result.offset, direct_result.limit, lazy=True)
+    return collect_bindings(result)
+
+
+def collect_bindings(result: dict) -> dict:
+    # collect the bindings of a SELECT result up to the streaming minimum, larger results remain lazy to be streamed
+    if 'results' in result.keys():
+        bindings = iter(result['results']['bindings'])
+        collected = list(itertools.islice(bindings, STREAMING_RESPONSE_MIN_ROWS))
+        if len(collected) < STREAMING_RESPONSE_MIN_ROWS:
+            result['results']['bindings'] = collected
+        else:
+            result['results']['bindings'] = itertools.chain(collected, bindings)
     return result
 
 
-def handle_update(requester_id: str, update: str, gaps_enabled):
+async def handle_update(requester_id: str, update: str, gaps_enabled):
     # check whether the requester's knowledge base already exists, if not create it
     try:
-        knowledge_network.check_knowledge_base_existence(requester_id)
+        await knowledge_network.check_knowledge_base_existence(requester_id)
     except Exception as e:
         logger.debug(f"An unexpected error in requester knowledge base occurred: {e}")
         raise HTTPException(status_code=500,
@@ -584,7 +843,7 @@ def handle_update(requester_id: str, update: str, gaps_enabled):
         
     # fire the update on the knowledge network
     try:
-        answer = request_processor.executeUpdateOnKnowledgeNetwork(update_decomposition, requester_id, gaps_enabled)
+        answer = await request_processor.executeUpdateOnKnowledgeNetwork(update_decomposition, requester_id, gaps_enabled)
     except Exception as e:
         logger.debug(f"Failed to execute the update request: {e}")
         raise HTTPException(status_code=500,
@@ -0,0 +1,152 @@
+# basic imports
+import time
+import threading
+import logging
+import logging_config as lc
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+####################
+# ENABLING LOGGING #
+####################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(lc.LOG_LEVEL)
+
+
+###################
+# GENERIC CLASSES #
+###################
+
+class LRUCache:
+    # a bounded, thread-safe least-recently-used cache with an optional time-to-live per entry.
+    # when an entry is evicted (because the cache is full or the entry expired) the optional
+    # on_evict callback is called with the key and value, outside of the lock of the cache.
+    # optionally, the cache is also bounded by the total weight (e.g. the number of bytes) of its values.
+    # with sliding, the time-to-live of an entry starts again whenever it is used, so that only idle entries expire.
+
+    def __init__(self, maxsize: int, ttl: float = 0, on_evict: Callable[[Hashable, Any], None] = None,
+                 max_weight: int = 0, weigh: Callable[[Any], int] = None, sliding: bool = False) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+        self.on_evict = on_evict
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries and not self._is_expired(self._entries[key][1])
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                value, stored_at = self._entries[key]
+                if self._is_expired(stored_at):
+                    self._remove(key)
+                    self.evictions += 1
+                    evicted.append((key, value))
+                else:
+                    if self.sliding:
+                        self._entries[key] = (value, time.monotonic())
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+        self._call_on_evict(evicted)
+        return default
+
+    def put(self, key: Hashable, value: Any, replace: bool = False) -> Any:
+        # store the value for the key, unless the key already holds a live value: in that case
+        # the existing value is kept and returned, so that concurrent producers agree on one value.
+        # with replace, the existing value is always replaced by the new value
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                existing, stored_at = self._entries[key]
+                if not replace and not self._is_expired(stored_at):
+                    self._entries.move_to_end(key)
+                    return existing
+                self._remove(key)
+                self.evictions += 1
+                evicted.append((key, existing))
+            weight = self._weigh(value)
+            if self.max_weight > 0 and weight > self.max_weight:
+                # the value on its own is already too heavy, so it is not cached at all
+                return value
+            self._entries[key] = (value, time.monotonic())
+            self.weight += weight
+            while len(self._entries) > self.maxsize or (self.max_weight > 0 and self.weight > self.max_weight):
+                old_key = next(iter(self._entries))
+                old_value = self._remove(old_key)
+                self.evictions += 1
+                evicted.append((old_key, old_value))
+        self._call_on_evict(evicted)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        # remove the entry without calling the on_evict callback
+        with self._lock:
+            if key in self._entries:
+                return self._remove(key)
+        return default
+
+    def expire(self) -> list:
+        # remove all expired entries, e.g. periodically when the cache is not used, and return them
+        evicted = []
+        with self._lock:
+            for key, (value, stored_at) in list(self._entries.items()):
+                if self._is_expired(stored_at):
+                    self._remove(key)
+                    self.evictions += 1
+                    evicted.append((key, value))
+        self._call_on_evict(evicted)
+        return evicted
+
+    def clear(self) -> list:
+        # remove all entries without calling the on_evict callback and return them
+        with self._lock:
+            items = [(key, value) for key, (value, _) in self._entries.items()]
+            self._entries.clear()
+            self.weight = 0
+        return items
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "weight": self.weight,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _weigh(self, value: Any) -> int:
+        return self.weigh(value) if self.weigh is not None else 0
+
+    def _remove(self, key: Hashable) -> Any:
+        value = self._entries.pop(key)[0]
+        self.weight -= self._weigh(value)
+        return value
+
+    def _is_expired(self, stored_at: float) -> bool:
+        return self.ttl > 0 and time.monotonic() - stored_at > self.ttl
+
+    def _call_on_evict(self, evicted: list):
+        if self.on_evict is None:
+            return
+        for key, value in evicted:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logger.warning(f"Eviction of cache entry {key} failed: {e}")
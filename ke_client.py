@@ -0,0 +1,122 @@
+# basic imports
+import asyncio
+import httpx
+import logging
+import logging_config as lc
+
+# knowledge engine imports
+from knowledge_mapper.tke_client import REASONER_ENABLED
+from knowledge_mapper.knowledge_interaction import KnowledgeInteractionRegistrationRequest
+from knowledge_mapper.knowledge_interaction import AskKnowledgeInteractionRegistrationRequest, PostKnowledgeInteractionRegistrationRequest
+from knowledge_mapper.tke_exceptions import UnexpectedHttpResponseError
+
+####################
+# ENABLING LOGGING #
+####################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(lc.LOG_LEVEL)
+
+
+###################
+# GENERIC CLASSES #
+###################
+
+class KnowledgeEngineClient:
+    # an asyncio client for the REST API of a Knowledge Engine smart connector that reuses
+    # its HTTP connections (keep-alive) for all requests that are done on the same event loop
+
+    def __init__(self, ke_url: str, max_connections: int = 100, timeout: float = None) -> None:
+        self.ke_url = ke_url
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.timeout = httpx.Timeout(timeout)
+        self._client = None
+        self._loop = None
+
+    def client(self) -> httpx.AsyncClient:
+        # an httpx client is bound to the event loop it is used on, so create a new one when the loop changes
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.ke_url, limits=self.limits, timeout=self.timeout)
+            self._loop = loop
+        return self._client
+
+    async def close(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+    async def get_knowledge_bases(self) -> list:
+        response = await self.client().get("/sc")
+        if not response.is_success:
+            raise UnexpectedHttpResponseError(response)
+        return response.json()
+
+    async def get_knowledge_base(self, kb_id: str) -> dict | None:
+        response = await self.client().get("/sc", headers={"Knowledge-Base-Id": kb_id})
+        if response.status_code == 404:
+            return None
+        if not response.is_success:
+            raise UnexpectedHttpResponseError(response)
+        return response.json()[0]
+
+    async def register_knowledge_base(self, kb_id: str, name: str, description: str, reregister: bool = False) -> bool:
+        # returns False when a knowledge base with this id already exists and should not be reregistered
+        if await self.get_knowledge_base(kb_id) is not None:
+            if reregister:
+                await self.unregister_knowledge_base(kb_id)
+            else:
+                return False
+        body = {
+            "knowledgeBaseId": kb_id,
+            "knowledgeBaseName": name,
+            "knowledgeBaseDescription": description
+        }
+        if REASONER_ENABLED:
+            body["reasonerEnabled"] = True
+        response = await self.client().post("/sc", json=body)
+        if not response.is_success:
+            raise UnexpectedHttpResponseError(response)
+        return True
+
+    async def unregister_knowledge_base(self, kb_id: str):
+        response = await self.client().delete("/sc", headers={"Knowledge-Base-Id": kb_id})
+        if not response.is_success:
+            raise UnexpectedHttpResponseError(response)
+
+    async def register_knowledge_interaction(self, kb_id: str, req: KnowledgeInteractionRegistrationRequest, name: str = None) -> str:
+        body = {"knowledgeInteractionType": req.type, "prefixes": req.prefixes}
+        if name is not None:
+            body["knowledgeInteractionName"] = name
+        if isinstance(req, AskKnowledgeInteractionRegistrationRequest):
+            body["graphPattern"] = req.pattern
+            body["knowledgeGapsEnabled"] = req.knowledge_gaps_enabled
+        elif isinstance(req, PostKnowledgeInteractionRegistrationRequest):
+            body["argumentGraphPattern"] = req.argument_pattern
+            body["resultGraphPattern"] = req.result_pattern
+        else:
+            raise Exception("Only ASK and POST knowledge interactions can be registered by the endpoint")
+        response = await self.client().post("/sc/ki", headers={"Knowledge-Base-Id": kb_id}, json=body)
+        if not response.is_success:
+            raise UnexpectedHttpResponseError(response)
+        ki_id = response.json()["knowledgeInteractionId"]
+        logger.debug(f"Successfully registered knowledge interaction {ki_id}")
+        return ki_id
+
+    async def unregister_knowledge_interaction(self, kb_id: str, ki_id: str):
+        response = await self.client().delete("/sc/ki", headers={"Knowledge-Base-Id": kb_id, "Knowledge-Interaction-Id": ki_id})
+        if not response.is_success:
+            raise UnexpectedHttpResponseError(response)
+
+    async def ask(self, kb_id: str, ki_id: str, bindings: list) -> dict:
+        response = await self.client().post("/sc/ask", json=bindings, headers={"Knowledge-Base-Id": kb_id, "Knowledge-Interaction-Id": ki_id})
+        if not response.is_success:
+            raise UnexpectedHttpResponseError(response)
+        return response.json()
+
+    async def post(self, kb_id: str, ki_id: str, bindings: list) -> dict:
+        response = await self.client().post("/sc/post", json=bindings, headers={"Knowledge-Base-Id": kb_id, "Knowledge-Interaction-Id": ki_id})
+        if not response.is_success:
+            raise UnexpectedHttpResponseError(response)
+        return response.json()
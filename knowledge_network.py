@@ -1,20 +1,30 @@
 # basic imports
 import os
-import requests
+import asyncio
+import json
 import uuid
+import tempfile
+import hashlib
 import logging
 import logging_config as lc
 import time
+from contextlib import contextmanager
+
+# cache imports
+from cache import LRUCache
+from shared_state import SharedState
+# metrics imports
+import metrics
 
 # graph imports
 import rdflib
 from rdflib import RDF, Graph, Namespace, URIRef, Literal
 
 # knowledge engine imports
-from knowledge_mapper.tke_client import TkeClient
 from knowledge_mapper.knowledge_base import KnowledgeBaseRegistrationRequest
 from knowledge_mapper.knowledge_base import KnowledgeBase
 from knowledge_mapper import knowledge_interaction
+from ke_client import KnowledgeEngineClient
 from knowledge_mapper.knowledge_interaction import AskKnowledgeInteractionRegistrationRequest, PostKnowledgeInteractionRegistrationRequest
 from knowledge_mapper.tke_exceptions import UnexpectedHttpResponseError
 
@@ -24,6 +34,7 @@ from knowledge_mapper.tke_exceptions import UnexpectedHttpResponseError
 
 logger = logging.getLogger(__name__)
 logger.setLevel(lc.LOG_LEVEL)
+payload_logger = lc.getPayloadLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
@@ -45,38 +56,228 @@ if "KNOWLEDGE_BASE_ID_PREFIX" in os.environ:
 else:
     raise Exception("Missing Knowledge Base ID prefix => You should provide a correct ID prefix for the SPARQL endpoint Knowledge Bases in the environment variable KNOWLEDGE_BASE_ID_PREFIX")
 
+if "KNOWLEDGE_INTERACTION_CACHE_SIZE" in os.environ:
+    try:
+        KNOWLEDGE_INTERACTION_CACHE_SIZE = int(os.getenv("KNOWLEDGE_INTERACTION_CACHE_SIZE"))
+    except ValueError:
+        raise Exception("Incorrect KNOWLEDGE_INTERACTION_CACHE_SIZE => You should provide a positive integer in the environment variable KNOWLEDGE_INTERACTION_CACHE_SIZE")
+    if KNOWLEDGE_INTERACTION_CACHE_SIZE < 1:
+        raise Exception("Incorrect KNOWLEDGE_INTERACTION_CACHE_SIZE => You should provide a positive integer in the environment variable KNOWLEDGE_INTERACTION_CACHE_SIZE")
+else: # no cache size, so keep at most 100 knowledge interactions per knowledge base
+    KNOWLEDGE_INTERACTION_CACHE_SIZE = 100
+logger.info(f"KNOWLEDGE_INTERACTION_CACHE_SIZE is set to {KNOWLEDGE_INTERACTION_CACHE_SIZE}")
+
+if "KNOWLEDGE_INTERACTION_CACHE_TTL" in os.environ:
+    try:
+        KNOWLEDGE_INTERACTION_CACHE_TTL = float(os.getenv("KNOWLEDGE_INTERACTION_CACHE_TTL"))
+    except ValueError:
+        raise Exception("Incorrect KNOWLEDGE_INTERACTION_CACHE_TTL => You should provide a number of seconds (0 means no expiry) in the environment variable KNOWLEDGE_INTERACTION_CACHE_TTL")
+else: # no time-to-live, so keep knowledge interactions for at most an hour
+    KNOWLEDGE_INTERACTION_CACHE_TTL = 3600
+logger.info(f"KNOWLEDGE_INTERACTION_CACHE_TTL is set to {KNOWLEDGE_INTERACTION_CACHE_TTL}")
+
+if "KNOWLEDGE_ENGINE_MAX_CONNECTIONS" in os.environ:
+    try:
+        KNOWLEDGE_ENGINE_MAX_CONNECTIONS = int(os.getenv("KNOWLEDGE_ENGINE_MAX_CONNECTIONS"))
+    except ValueError:
+        raise Exception("Incorrect KNOWLEDGE_ENGINE_MAX_CONNECTIONS => You should provide a positive integer in the environment variable KNOWLEDGE_ENGINE_MAX_CONNECTIONS")
+    if KNOWLEDGE_ENGINE_MAX_CONNECTIONS < 1:
+        raise Exception("Incorrect KNOWLEDGE_ENGINE_MAX_CONNECTIONS => You should provide a positive integer in the environment variable KNOWLEDGE_ENGINE_MAX_CONNECTIONS")
+else: # no maximum, so keep at most 100 connections open to the knowledge network
+    KNOWLEDGE_ENGINE_MAX_CONNECTIONS = 100
+logger.info(f"KNOWLEDGE_ENGINE_MAX_CONNECTIONS is set to {KNOWLEDGE_ENGINE_MAX_CONNECTIONS}")
+
+if "MAX_KNOWLEDGE_BASES" in os.environ:
+    try:
+        MAX_KNOWLEDGE_BASES = int(os.getenv("MAX_KNOWLEDGE_BASES"))
+    except ValueError:
+        raise Exception("Incorrect MAX_KNOWLEDGE_BASES => You should provide a positive integer in the environment variable MAX_KNOWLEDGE_BASES")
+    if MAX_KNOWLEDGE_BASES < 1:
+        raise Exception("Incorrect MAX_KNOWLEDGE_BASES => You should provide a positive integer in the environment variable MAX_KNOWLEDGE_BASES")
+else: # no maximum, so keep at most 1000 knowledge bases of requesters registered
+    MAX_KNOWLEDGE_BASES = 1000
+logger.info(f"MAX_KNOWLEDGE_BASES is set to {MAX_KNOWLEDGE_BASES}")
+
+if "KNOWLEDGE_BASE_IDLE_TIMEOUT" in os.environ:
+    try:
+        KNOWLEDGE_BASE_IDLE_TIMEOUT = float(os.getenv("KNOWLEDGE_BASE_IDLE_TIMEOUT"))
+    except ValueError:
+        raise Exception("Incorrect KNOWLEDGE_BASE_IDLE_TIMEOUT => You should provide a number of seconds (0 means no expiry) in the environment variable KNOWLEDGE_BASE_IDLE_TIMEOUT")
+else: # no idle timeout, so unregister knowledge bases that are not used for an hour
+    KNOWLEDGE_BASE_IDLE_TIMEOUT = 3600
+logger.info(f"KNOWLEDGE_BASE_IDLE_TIMEOUT is set to {KNOWLEDGE_BASE_IDLE_TIMEOUT}")
+
+if "SHUTDOWN_TIMEOUT" in os.environ:
+    try:
+        SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT"))
+    except ValueError:
+        raise Exception("Incorrect SHUTDOWN_TIMEOUT => You should provide a positive number of seconds in the environment variable SHUTDOWN_TIMEOUT")
+    if SHUTDOWN_TIMEOUT <= 0:
+        raise Exception("Incorrect SHUTDOWN_TIMEOUT => You should provide a positive number of seconds in the environment variable SHUTDOWN_TIMEOUT")
+else: # no timeout, so give the knowledge bases at most 10 seconds to be unregistered when stopping
+    SHUTDOWN_TIMEOUT = 10
+logger.info(f"SHUTDOWN_TIMEOUT is set to {SHUTDOWN_TIMEOUT}")
+
+if "SHARED_STATE_PATH" in os.environ:
+    SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH")
+    if SHARED_STATE_PATH == "":
+        raise Exception("Incorrect SHARED_STATE_PATH => You should provide a correct path to an SQLite database file in the environment variable SHARED_STATE_PATH")
+else: # no shared state path, so share the state with the workers on this node that use the same knowledge base ids at the same knowledge network
+    SHARED_STATE_PATH = os.path.join(tempfile.gettempdir(), "sparql-endpoint-state-"+hashlib.sha256((KNOWLEDGE_ENGINE_URL+" "+KNOWLEDGE_BASE_ID_PREFIX).encode()).hexdigest()[:16]+".sqlite")
+logger.info(f"SHARED_STATE_PATH is set to {SHARED_STATE_PATH}")
+
+
+###########################
+#  KNOWLEDGE BASE REGISTRY #
+###########################
+
+class KnowledgeBaseRegistry:
+    # keeps the knowledge bases that are registered for requesters, where concurrent first requests
+    # of the same requester wait for a single registration, while other requesters are not held up.
+    # knowledge bases that are idle for too long, or the least recently used ones when there are too many,
+    # are unregistered in the background and registered again upon the next request of their requester
+
+    def __init__(self, maxsize: int, idle_timeout: float) -> None:
+        self.knowledge_bases = LRUCache(maxsize, idle_timeout, on_evict=self.unregisterInBackground, sliding=True)
+        self.locks = {}
+        self.lock_users = {}
+        self.unregistrations = {}
+
+    def __contains__(self, kb_id: str) -> bool:
+        return kb_id in self.knowledge_bases
+
+    def __len__(self) -> int:
+        return len(self.knowledge_bases)
+
+    def stats(self) -> dict:
+        return self.knowledge_bases.stats()
+
+    async def register(self, requester_id: str) -> str:
+        kb_id = KNOWLEDGE_BASE_ID_PREFIX+requester_id
+        if self.knowledge_bases.get(kb_id) is not None:
+            logger.debug(f"Knowledge Base for '{requester_id}' already created at the Knowledge Network")
+            return kb_id
+        # the lock of a requester is kept while any request holds or waits for it, so that they all use the same lock
+        lock = self.locks.setdefault(kb_id, asyncio.Lock())
+        self.lock_users[kb_id] = self.lock_users.get(kb_id, 0) + 1
+        try:
+            async with lock:
+                # check again, because another request might have created it while waiting for the lock
+                if self.knowledge_bases.get(kb_id) is not None:
+                    logger.debug(f"Knowledge Base for '{requester_id}' already created at the Knowledge Network")
+                    return kb_id
+                # an evicted knowledge base can only be registered again once it has been unregistered
+                if kb_id in self.unregistrations:
+                    await asyncio.wait([self.unregistrations[kb_id]])
+                # create a knowledge base for the requester ID, or use the one of another worker
+                try:
+                    kb = await self.registerShared(kb_id)
+                except Exception as e:
+                    raise Exception(f'An unexpected error occurred: {e}')
+                knowledge_interactions[kb_id] = create_knowledge_interaction_cache(kb_id)
+                self.knowledge_bases.put(kb_id, kb, replace=True)
+                logger.info(f"Successfully registered a Knowledge Base for '{requester_id}' at the Knowledge Network")
+        finally:
+            self.lock_users[kb_id] -= 1
+            if self.lock_users[kb_id] == 0:
+                del self.lock_users[kb_id]
+                del self.locks[kb_id]
+        return kb_id
+
+    async def registerShared(self, kb_id: str) -> KnowledgeBaseRegistrationRequest:
+        # only the worker that claims the knowledge base registers it, the other workers wait until it is registered
+        while True:
+            match await shared_state.claim_knowledge_base(kb_id):
+                case "registered":
+                    logger.debug(f"Using the Knowledge Base {kb_id} that is registered by another worker")
+                    return KnowledgeBaseRegistrationRequest(id=kb_id, name="SPARQL endpoint "+kb_id, description="")
+                case "claimed":
+                    try:
+                        # a knowledge base that already exists was registered by a worker that is gone, so it is used as well
+                        kb = await create_knowledge_base(kb_id, use_existing=True)
+                    except Exception as e:
+                        await shared_state.release_knowledge_base(kb_id)
+                        raise e
+                    await shared_state.complete_knowledge_base(kb_id)
+                    return kb
+                case _:
+                    # another worker is still registering or unregistering the knowledge base
+                    await asyncio.sleep(0.05)
+
+    async def forgetIfUnknown(self, kb_id: str) -> bool:
+        # returns whether the knowledge base should be registered again, because it has been evicted in the meantime
+        # or because it is unknown at the knowledge network, in which case it is forgotten by this and the other workers
+        if kb_id not in self.knowledge_bases:
+            return True
+        try:
+            if await ke_client.get_knowledge_base(kb_id) is not None:
+                return False
+        except Exception as e:
+            logger.debug(f"Existence of Knowledge Base {kb_id} could not be checked: {e}")
+            return False
+        logger.warning(f"Knowledge Base {kb_id} is unknown at the Knowledge Network, it will be registered again")
+        self.knowledge_bases.pop(kb_id)
+        knowledge_interactions.pop(kb_id, None)
+        await shared_state.release_unknown_knowledge_base(kb_id)
+        return True
+
+    def evictIdle(self):
+        self.knowledge_bases.expire()
+
+    def unregisterInBackground(self, kb_id: str, kb: KnowledgeBaseRegistrationRequest):
+        # unregistering the knowledge base also removes its knowledge interactions, so just forget them
+        knowledge_interactions.pop(kb_id, None)
+        async def unregister():
+            # with multiple workers, a knowledge base is only unregistered by the last worker that evicts it
+            if not await shared_state.leave_knowledge_base(kb_id):
+                logger.debug(f"Evicted Knowledge Base {kb_id} is still used by other workers")
+                return
+            try:
+                await ke_client.unregister_knowledge_base(kb_id)
+                logger.info(f"Unregistered evicted Knowledge Base {kb_id}")
+            except Exception as e:
+                logger.warning(f"Evicted Knowledge Base {kb_id} could not be unregistered: {e}")
+            finally:
+                # only now the other workers can register the knowledge base again
+                await shared_state.complete_unregistration(kb_id)
+        task = asyncio.get_running_loop().create_task(unregister())
+        self.unregistrations[kb_id] = task
+        task.add_done_callback(lambda done: self.unregistrations.pop(kb_id, None))
+
+    def clear(self) -> list:
+        # forget all knowledge bases without unregistering them and return their ids
+        return [kb_id for kb_id, kb in self.knowledge_bases.clear()]
+
+
 #########################
 # GENERIC START-UP CODE #
 #########################
 
-# start a knowledge engine runtime and connect it to the knowledge network
-tke_client = TkeClient(KNOWLEDGE_ENGINE_URL)
-try:
-    tke_client.connect()
-except Exception as e:
-    logger.error(f"Please check whether the knowledge network is up and running at {KNOWLEDGE_ENGINE_URL}")
+# all requests to the knowledge network are done by an asyncio client that reuses its connections
+ke_client = KnowledgeEngineClient(KNOWLEDGE_ENGINE_URL, max_connections=KNOWLEDGE_ENGINE_MAX_CONNECTIONS)
 
-# define a knowledge base creation function for the knowledge network
-def create_knowledge_base(kb_id: str) -> KnowledgeBase:
-    # register the SPARQL endpoint to the knowledge network as a new Knowledge Base for the requester
-    kb_name = "SPARQL endpoint "+kb_id
-    try:
-        kb = tke_client.register(KnowledgeBaseRegistrationRequest(id=kb_id, name=kb_name, description=""),
-                                 reregister = False)
-    except Exception as e:
-        raise Exception(f'Failed to register a knowledge base {kb_id} at the knowledge network: {e}')
-    # if kb is None, a knowledge base with this kb_id already exists
-    if kb == None:
-        raise Exception(f'Knowledge base with id {kb_id} already exists!')
-    return kb
+# keep a reference to background tasks, such as unregistering evicted knowledge interactions, until they are done
+background_tasks = set()
 
-# add a dummy KB and delete it again to start the KE runtime
-dummy_kb = create_knowledge_base(KNOWLEDGE_BASE_ID_PREFIX+"dummy")
-time.sleep(1)
-dummy_kb.unregister()
+# the state that is shared with the other workers of the endpoint
+shared_state = SharedState(SHARED_STATE_PATH)
 
-# start an empty dictionary with a mapping between requester_ids and knowledge bases
-knowledge_bases = {}
+# start an empty registry with a mapping between knowledge base ids of requesters and their knowledge bases
+knowledge_bases = KnowledgeBaseRegistry(MAX_KNOWLEDGE_BASES, KNOWLEDGE_BASE_IDLE_TIMEOUT)
+
+# start an empty dictionary with a mapping between knowledge base ids and their cache of registered knowledge interactions
+knowledge_interactions = {}
+
+# start empty dictionaries with the number of asks and posts in flight per knowledge interaction key of a knowledge base,
+# and with the evicted knowledge interactions of those keys that are only unregistered once the key is no longer used
+knowledge_interaction_users = {}
+deferred_knowledge_interactions = {}
+
+# start an empty dictionary with a mapping between identical asks and the task that is currently asking them
+in_flight_asks = {}
+
+# the endpoint is ready once the knowledge engine runtime answers, which is probed when the endpoint starts
+knowledge_network_ready = False
 
 
 ###########################
@@ -84,65 +285,162 @@ knowledge_bases = {}
 ###########################
 
 
-def check_knowledge_base_existence(requester_id: str):
-    req_kb_id = KNOWLEDGE_BASE_ID_PREFIX+requester_id
-    if (req_kb_id not in knowledge_bases.keys()):
-        # create a knowledge base for the requester ID
-        try:
-            knowledge_bases[req_kb_id] = create_knowledge_base(req_kb_id)    
-        except Exception as e:
-            raise Exception(f'An unexpected error occurred: {e}')
-        logger.info(f"Successfully registered a Knowledge Base for '{requester_id}' at the Knowledge Network")
+async def create_knowledge_base(kb_id: str, use_existing: bool = False) -> KnowledgeBaseRegistrationRequest:
+    # register the SPARQL endpoint to the knowledge network as a new Knowledge Base for the requester
+    kb = KnowledgeBaseRegistrationRequest(id=kb_id, name="SPARQL endpoint "+kb_id, description="")
+    try:
+        registered = await ke_client.register_knowledge_base(kb.id, kb.name, kb.description, reregister = False)
+    except Exception as e:
+        raise Exception(f'Failed to register a knowledge base {kb_id} at the knowledge network: {e}')
+    # if it is not registered, a knowledge base with this kb_id already exists
+    if not registered and use_existing:
+        logger.info(f"Using the existing Knowledge Base {kb_id}")
+    elif not registered:
+        raise Exception(f'Knowledge base with id {kb_id} already exists!')
+    return kb
+
+
+async def probeKnowledgeNetwork() -> bool:
+    # the knowledge engine runtime is ready when it answers the request for its knowledge bases
+    global knowledge_network_ready
+    try:
+        await ke_client.get_knowledge_bases()
+    except Exception as e:
+        logger.debug(f"Knowledge network at {KNOWLEDGE_ENGINE_URL} is not ready: {e}")
+        return False
+    if not knowledge_network_ready:
+        logger.info(f"Successfully connected to the knowledge network at {KNOWLEDGE_ENGINE_URL}")
+    knowledge_network_ready = True
+    return True
+
+
+async def waitUntilKnowledgeNetworkIsReady():
+    # probe the knowledge network with an increasing interval until it answers, without blocking the start of the endpoint
+    interval = 0.1
+    while not await probeKnowledgeNetwork():
+        logger.warning(f"Please check whether the knowledge network is up and running at {KNOWLEDGE_ENGINE_URL}, retrying in {interval} seconds")
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, 5)
+
+
+async def check_knowledge_base_existence(requester_id: str):
+    await knowledge_bases.register(requester_id)
+
+
+async def preregisterKnowledgeBases(requester_ids: list):
+    # register the knowledge bases of known requesters upfront, so that their first requests do not wait for it
+    logger.info(f"Preregistering knowledge bases for {len(requester_ids)} requesters!")
+    results = await asyncio.gather(*[knowledge_bases.register(requester_id) for requester_id in requester_ids],
+                                   return_exceptions=True)
+    for requester_id, result in zip(requester_ids, results):
+        if isinstance(result, Exception):
+            # the knowledge base will be registered again upon the first request of the requester
+            logger.warning(f"Knowledge Base for '{requester_id}' could not be preregistered: {result}")
+
+
+def create_knowledge_interaction_cache(kb_id: str) -> LRUCache:
+    # registered knowledge interactions are reused for the same pattern and only unregistered when evicted
+    return LRUCache(KNOWLEDGE_INTERACTION_CACHE_SIZE, KNOWLEDGE_INTERACTION_CACHE_TTL,
+                    on_evict=lambda key, ki_id: unregisterKnowledgeInteractionInBackground(kb_id, ki_id, key))
+
+
+async def askPatternAtKnowledgeNetwork(requester_id: str, graph_pattern: list, bindings: list, gaps_enabled: bool) -> list:
+    # identical asks that are in flight at the same time share a single call to the knowledge network
+    pattern = convertTriplesToPattern(graph_pattern)
+    key = (requester_id, pattern, gaps_enabled, json.dumps(bindings, sort_keys=True))
+    task = in_flight_asks.get(key)
+    shared = task is not None
+    if not shared:
+        task = asyncio.get_running_loop().create_task(askPatternOnceAtKnowledgeNetwork(requester_id, graph_pattern, bindings, gaps_enabled))
+        in_flight_asks[key] = task
+        task.add_done_callback(lambda done: in_flight_asks.pop(key, None))
     else:
-        logger.info(f"Knowledge Base for '{requester_id}' already created at the Knowledge Network")
-        
-        
-def askPatternAtKnowledgeNetwork(requester_id: str, graph_pattern: list, bindings: list, gaps_enabled: bool) -> list:
-    req_kb_id = KNOWLEDGE_BASE_ID_PREFIX+requester_id
+        logger.debug(f"Joining the identical ask that is already in flight for '{requester_id}'")
+    # shield the shared task, so that a cancelled waiter does not cancel the ask for the other waiters
+    start = time.perf_counter()
+    answer = await asyncio.shield(task)
+    metrics.traceAsk(pattern, bindings, answer, time.perf_counter() - start, shared)
+    return answer
 
-    # get the requesters' knowledge base
-    requester_kb = knowledge_bases[req_kb_id]
+
+async def askPatternOnceAtKnowledgeNetwork(requester_id: str, graph_pattern: list, bindings: list, gaps_enabled: bool) -> list:
+    # the knowledge base is registered again when it has been evicted since the start of the request
+    req_kb_id = await knowledge_bases.register(requester_id)
 
     # generate an ASK knowledge interaction from the triples
     ki = getAskKnowledgeInteractionFromTriples(graph_pattern)
 
     # build a registration request for the ASK knowledge interaction
     req = AskKnowledgeInteractionRegistrationRequest(pattern=ki["pattern"],knowledge_gaps_enabled=gaps_enabled)
-    logger.debug(f'Knowledge interaction registration request is {req}')
-
-    # register the ASK knowledge interaction for the knowledge base
-    registered_ki = requester_kb.register_knowledge_interaction(req, name=ki['name'])
+    payload_logger.debug("Knowledge interaction registration request is %s", lc.Payload(req))
 
-    # call the knowledge interaction with bindings
-    answer = registered_ki.ask(bindings)
-
-    # unregister the ASK knowledge interaction for the knowledge base
-    unregisterKnowledgeInteraction(req_kb_id, registered_ki.id)
+    # get the registered ASK knowledge interaction for this pattern or register a new one, and call it with bindings,
+    # while it is not unregistered when it is evicted by another request
+    key = ("ask", ki["pattern"], gaps_enabled)
+    with useKnowledgeInteraction(req_kb_id, key):
+        registered_ki, cached = None, False
+        try:
+            with metrics.measureStage("knowledge_interaction_registration"):
+                registered_ki, cached = await getOrRegisterKnowledgeInteraction(req_kb_id, key, req, ki['name'])
+            with metrics.measureStage("ask"):
+                answer = await ke_client.ask(req_kb_id, registered_ki, bindings)
+        except UnexpectedHttpResponseError as e:
+            # the knowledge base might have been evicted, or unregistered by another worker, in the meantime
+            reregister = await knowledge_bases.forgetIfUnknown(req_kb_id)
+            if not cached and not reregister:
+                raise e
+            # the cached knowledge interaction might no longer exist at the knowledge network, so register it again
+            logger.warning(f"ASK knowledge interaction {registered_ki} failed, registering it again: {e}")
+            if registered_ki is not None:
+                await forgetKnowledgeInteraction(req_kb_id, key, registered_ki)
+            # the knowledge base is registered again if needed
+            req_kb_id = await knowledge_bases.register(requester_id)
+            with metrics.measureStage("knowledge_interaction_registration"):
+                registered_ki, cached = await getOrRegisterKnowledgeInteraction(req_kb_id, key, req, ki['name'])
+            with metrics.measureStage("ask"):
+                answer = await ke_client.ask(req_kb_id, registered_ki, bindings)
+    metrics.countBindingsReceived("ask", answer)
 
     return answer
 
 
-def postPatternAtKnowledgeNetwork(requester_id: str, argument_graph_pattern: list, bindings: list) -> list:
-    req_kb_id = KNOWLEDGE_BASE_ID_PREFIX+requester_id
-
-    # get the requesters' knowledge base
-    requester_kb = knowledge_bases[req_kb_id]
+async def postPatternAtKnowledgeNetwork(requester_id: str, argument_graph_pattern: list, bindings: list) -> list:
+    # the knowledge base is registered again when it has been evicted since the start of the request
+    req_kb_id = await knowledge_bases.register(requester_id)
 
     # generate an POST knowledge interaction from the triples
     ki = getPostKnowledgeInteractionFromTriples(argument_graph_pattern)
 
     # build a registration request for the POST knowledge interaction
     req = PostKnowledgeInteractionRegistrationRequest(argument_pattern=ki["argument_pattern"],result_pattern=None)
-    logger.debug(f'Knowledge interaction registration request is {req}')
+    payload_logger.debug("Knowledge interaction registration request is %s", lc.Payload(req))
 
-    # register the POST knowledge interaction for the knowledge base
-    registered_ki = requester_kb.register_knowledge_interaction(req, name=ki['name'])
-
-    # call the knowledge interaction with bindings
-    answer = registered_ki.post(bindings)
-
-    # unregister the POST knowledge interaction for the knowledge base
-    unregisterKnowledgeInteraction(req_kb_id, registered_ki.id)
+    # get the registered POST knowledge interaction for this pattern or register a new one, and call it with bindings,
+    # while it is not unregistered when it is evicted by another request
+    key = ("post", ki["argument_pattern"])
+    with useKnowledgeInteraction(req_kb_id, key):
+        registered_ki, cached = None, False
+        try:
+            with metrics.measureStage("knowledge_interaction_registration"):
+                registered_ki, cached = await getOrRegisterKnowledgeInteraction(req_kb_id, key, req, ki['name'])
+            with metrics.measureStage("post"):
+                answer = await ke_client.post(req_kb_id, registered_ki, bindings)
+        except UnexpectedHttpResponseError as e:
+            # the knowledge base might have been evicted, or unregistered by another worker, in the meantime
+            reregister = await knowledge_bases.forgetIfUnknown(req_kb_id)
+            if not cached and not reregister:
+                raise e
+            # the cached knowledge interaction might no longer exist at the knowledge network, so register it again
+            logger.warning(f"POST knowledge interaction {registered_ki} failed, registering it again: {e}")
+            if registered_ki is not None:
+                await forgetKnowledgeInteraction(req_kb_id, key, registered_ki)
+            # the knowledge base is registered again if needed
+            req_kb_id = await knowledge_bases.register(requester_id)
+            with metrics.measureStage("knowledge_interaction_registration"):
+                registered_ki, cached = await getOrRegisterKnowledgeInteraction(req_kb_id, key, req, ki['name'])
+            with metrics.measureStage("post"):
+                answer = await ke_client.post(req_kb_id, registered_ki, bindings)
+    metrics.countBindingsReceived("post", answer)
 
     return answer
 
@@ -163,21 +461,138 @@ def getPostKnowledgeInteractionFromTriples(triples: list) -> dict:
     return knowledge_interaction
 
 
-def unregisterKnowledgeInteraction(kb_id, ki):
-    response = requests.delete(
-        f"{KNOWLEDGE_ENGINE_URL}/sc/ki", headers={"Knowledge-Base-Id": kb_id, "Knowledge-Interaction-Id": ki}
-    )
-    if not response.ok:
-        raise UnexpectedHttpResponseError(response)
+async def getOrRegisterKnowledgeInteraction(kb_id: str, key: tuple, req, name: str) -> tuple:
+    ki_cache = knowledge_interactions.get(kb_id)
+    if ki_cache is None:
+        raise Exception(f'Knowledge Base {kb_id} has been evicted, it should be registered again before registering a knowledge interaction')
+
+    # first, check whether a knowledge interaction for this key has already been registered
+    registered_ki = ki_cache.get(key)
+    if registered_ki is not None:
+        logger.debug(f"Reusing registered knowledge interaction {registered_ki}")
+        return registered_ki, True
+
+    # with multiple workers, use the knowledge interaction that another worker registered for this key
+    registered_ki = await shared_state.get_knowledge_interaction(kb_id, key)
+    if registered_ki is not None:
+        logger.debug(f"Reusing knowledge interaction {registered_ki} of another worker")
+        return ki_cache.put(key, registered_ki), True
+
+    # if not, register the knowledge interaction for the requesters' knowledge base and cache it
+    registered_ki = await ke_client.register_knowledge_interaction(kb_id, req, name=name)
+    shared_ki = await shared_state.put_knowledge_interaction(kb_id, key, registered_ki)
+    if shared_ki != registered_ki:
+        # another worker registered the same knowledge interaction in the meantime, so only keep that one
+        await unregisterKnowledgeInteraction(kb_id, registered_ki)
+        registered_ki = shared_ki
+    cached_ki = ki_cache.put(key, registered_ki)
+    if cached_ki != registered_ki:
+        # another request registered the same knowledge interaction in the meantime, so only keep that one
+        await unregisterKnowledgeInteraction(kb_id, registered_ki)
+        registered_ki = cached_ki
+
+    return registered_ki, False
+
+
+async def forgetKnowledgeInteraction(kb_id: str, key: tuple, registered_ki: str):
+    # remove the knowledge interaction from the cache and try to unregister it
+    ki_cache = knowledge_interactions.get(kb_id)
+    if ki_cache is not None and ki_cache.get(key) == registered_ki:
+        ki_cache.pop(key)
+    await shared_state.remove_knowledge_interaction(kb_id, key, registered_ki)
+    try:
+        await unregisterKnowledgeInteraction(kb_id, registered_ki)
+    except Exception as e:
+        logger.debug(f"Knowledge interaction {registered_ki} could not be unregistered: {e}")
+
+
+async def unregisterKnowledgeInteraction(kb_id, ki):
+    await ke_client.unregister_knowledge_interaction(kb_id, ki)
 
 
-def unregisterKnowledgeBases():
+def unregisterKnowledgeInteractionInBackground(kb_id, ki, key):
+    # evicted knowledge interactions are unregistered without letting the current request wait for it,
+    # other workers that still use it register it again when their ask or post with it fails
+    # an ask or post in flight might still use it, so then it is unregistered after the last one is done
+    if (kb_id, key) in knowledge_interaction_users:
+        deferred_knowledge_interactions.setdefault((kb_id, key), []).append(ki)
+        return
+    async def unregister():
+        await shared_state.remove_knowledge_interaction(kb_id, key, ki)
+        try:
+            await unregisterKnowledgeInteraction(kb_id, ki)
+            logger.debug(f"Unregistered evicted knowledge interaction {ki}")
+        except Exception as e:
+            logger.warning(f"Evicted knowledge interaction {ki} could not be unregistered: {e}")
+    task = asyncio.get_running_loop().create_task(unregister())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+@contextmanager
+def useKnowledgeInteraction(kb_id: str, key: tuple):
+    # knowledge interactions for the key that are evicted while it is used are not unregistered until it is no longer used
+    knowledge_interaction_users[(kb_id, key)] = knowledge_interaction_users.get((kb_id, key), 0) + 1
+    try:
+        yield
+    finally:
+        knowledge_interaction_users[(kb_id, key)] -= 1
+        if knowledge_interaction_users[(kb_id, key)] == 0:
+            del knowledge_interaction_users[(kb_id, key)]
+            for ki in deferred_knowledge_interactions.pop((kb_id, key), []):
+                unregisterKnowledgeInteractionInBackground(kb_id, ki, key)
+
+
+async def evictIdleKnowledgeBases():
+    # regularly unregister the knowledge bases that are idle for too long, also when no requests come in
+    while True:
+        await asyncio.sleep(max(KNOWLEDGE_BASE_IDLE_TIMEOUT / 2, 1))
+        knowledge_bases.evictIdle()
+
+
+async def unregisterKnowledgeBases() -> list:
+    # unregister all knowledge bases concurrently, but give up on those that are not unregistered before the deadline
+    kb_ids = knowledge_bases.clear()
+    # with multiple workers, a worker that stops only unregisters the knowledge bases that the other workers do not use,
+    # while the last worker that stops unregisters the knowledge bases of all workers
+    if await shared_state.leave_workers():
+        kb_ids = list(dict.fromkeys(kb_ids + await shared_state.knowledge_base_ids()))
+        await shared_state.clear()
+    else:
+        logger.info("Leaving the knowledge bases that are used by the other workers registered for them!")
+        kb_ids = [kb_id for kb_id in kb_ids if await shared_state.leave_knowledge_base(kb_id)]
+        knowledge_interactions.clear()
     logger.info("Unregistering knowledge bases!")
-    for key in knowledge_bases.keys():
+    tasks = {}
+    for key in kb_ids:
         logger.debug(f'Key is {key}')
-        kb = knowledge_bases[key]
-        kb.unregister()
-        logger.debug(f'Unregistered kb {kb}')
+        # unregistering the knowledge base also removes its knowledge interactions, so just empty the cache
+        if key in knowledge_interactions.keys():
+            knowledge_interactions.pop(key).clear()
+        tasks[key] = asyncio.create_task(ke_client.unregister_knowledge_base(key))
+    failed = []
+    # evicted knowledge bases that are still being unregistered in the background are awaited as well
+    awaited = list(tasks.values()) + list(knowledge_bases.unregistrations.values())
+    if awaited:
+        done, pending = await asyncio.wait(awaited, timeout=SHUTDOWN_TIMEOUT)
+        for key, task in tasks.items():
+            if task in pending:
+                task.cancel()
+                failed.append(key)
+                logger.warning(f"Knowledge Base {key} was not unregistered within {SHUTDOWN_TIMEOUT} seconds")
+            elif task.exception() is not None:
+                failed.append(key)
+                logger.warning(f"Knowledge Base {key} could not be unregistered: {task.exception()}")
+            else:
+                logger.debug(f'Unregistered kb {key}')
+    for key in kb_ids:
+        await shared_state.complete_unregistration(key)
+    if failed:
+        logger.error(f"Failed to unregister {len(failed)} of {len(tasks)} knowledge bases: {failed}")
+    else:
+        logger.info(f"Unregistered {len(tasks)} knowledge bases")
+    await ke_client.close()
+    return failed
 
 
 ####################
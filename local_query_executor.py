@@ -7,30 +7,30 @@ import logging_config as lc
 import rdflib
 from rdflib.util import from_n3
 from rdflib import RDF, Graph, Namespace, URIRef, Literal
-from rdflib.plugins.sparql.parser import parseQuery
+from rdflib.plugins.sparql.sparql import Query
 
 # enable logging
 logger = logging.getLogger(__name__)
 logger.setLevel(lc.LOG_LEVEL)
+payload_logger = lc.getPayloadLogger(__name__)
 
 
 ####################################
 #    QUERY EXECUTION FUNCTIONS     #
 ####################################
 
-def executeQuery(graph: Graph, query: str) -> dict:
-    # run the original query on the graph to get the results
-    logger.debug(f"Query to be executed on local graph is: {query}")
-    parsed_query = parseQuery(query)
+def executeQuery(graph: Graph, query: Query, lazy: bool = False) -> dict:
+    # run the original, already translated query on the graph to get the results
+    payload_logger.debug("Query to be executed on local graph is: %s", lc.Payload(query.algebra))
     
-    if parsed_query[1].name == "SelectQuery":
+    if query.algebra.name == "SelectQuery":
         result = graph.query(query)
         # the result object should contain bindings and vars
-        logger.debug(f'Result of the SELECT query when executed on the local graph is: {result.bindings}')
+        payload_logger.debug("Result of the SELECT query when executed on the local graph is: %s", lc.Payload(result.bindings))
         # reformat the result into a SPARQL 1.1 JSON result structure
-        json_result = reformatResultIntoSPARQLJson(result) 
+        json_result = reformatResultIntoSPARQLJson(result, lazy)
 
-    if parsed_query[1].name == "AskQuery":
+    if query.algebra.name == "AskQuery":
         result = graph.query(query)
         # the result object should contain an askAnswer field
         logger.debug(f"Result of the ASK query when executed on the local graph is: {result.askAnswer}")
@@ -41,7 +41,59 @@ def executeQuery(graph: Graph, query: str) -> dict:
     
     return json_result
 
-def reformatResultIntoSPARQLJson(result:dict) -> dict:
+def executeDirectQuery(bindings: list, vars: list, distinct: bool = False, offset: int = 0, limit: int = None, lazy: bool = False) -> dict:
+    # the bindings from the knowledge network already are the solutions of the query, so only
+    # project, deduplicate and slice them and reformat them into a SPARQL 1.1 JSON result structure
+    terms = {}
+    def toTerm(value: str):
+        term = terms.get(value)
+        if term is None:
+            term = from_n3(value.encode('unicode_escape').decode('unicode_escape'))
+            terms[value] = term
+        return term
+
+    # like the evaluation on a local graph, identical solutions are only returned once and
+    # the solutions are handled one by one, so that no more bindings are used than needed for the slice
+    def generateBindings():
+        seen_solutions = set()
+        seen_rows = set()
+        skipped = 0
+        returned = 0
+        for binding in bindings:
+            if limit is not None and returned >= limit:
+                break
+            solution = tuple(sorted(binding.items()))
+            if solution in seen_solutions:
+                continue
+            seen_solutions.add(solution)
+            row = tuple(binding.get(var) for var in vars)
+            if distinct:
+                if row in seen_rows:
+                    continue
+                seen_rows.add(row)
+            if skipped < offset:
+                skipped += 1
+                continue
+            b = {}
+            for var, value in zip(vars, row):
+                if value is not None:
+                    term_json = reformatTermIntoSPARQLJson(toTerm(value))
+                    if term_json is not None:
+                        b[var] = term_json
+            returned += 1
+            yield b
+
+    # when lazy, the bindings are only reformatted when they are consumed, e.g. by a streaming response
+    json_bindings = generateBindings() if lazy else list(generateBindings())
+    if not lazy:
+        payload_logger.debug("Result of the SELECT query derived from the bindings is: %s", lc.Payload(json_bindings))
+
+    return {
+        "head" : { "vars": vars },
+        "results": { "bindings": json_bindings }
+    }
+
+def reformatResultIntoSPARQLJson(result:dict, lazy: bool = False) -> dict:
     json_result = {
         "head" : { "vars": [str(var) for var in result.vars]
             },
@@ -49,19 +101,25 @@ def reformatResultIntoSPARQLJson(result:dict) -> dict:
             "bindings": []
             }
     }
-    if result.bindings != []:
-        bindings = []
-        for binding in result.bindings:
-            b = {}
-            for key in binding:
-                if isinstance(binding[key],rdflib.term.Literal):
-                    if binding[key].datatype == None:
-                        b[str(key)] = {"type": "literal", "value": str(binding[key])}
-                    else:
-                        b[str(key)] = {"type": "typed-literal", "datatype": str(binding[key].datatype), "value": str(binding[key])}
-                if isinstance(binding[key],rdflib.term.URIRef):
-                    b[str(key)] = {"type": "uri", "value": str(binding[key])}
-            bindings.append(b)
-        json_result["results"] = {"bindings": bindings}
+    # when lazy, the bindings are only reformatted when they are consumed, e.g. by a streaming response
+    bindings = (reformatBindingIntoSPARQLJson(binding) for binding in result.bindings)
+    json_result["results"] = {"bindings": bindings if lazy else list(bindings)}
 
     return json_result
+
+def reformatBindingIntoSPARQLJson(binding: dict) -> dict:
+    b = {}
+    for key in binding:
+        term_json = reformatTermIntoSPARQLJson(binding[key])
+        if term_json is not None:
+            b[str(key)] = term_json
+    return b
+
+def reformatTermIntoSPARQLJson(term) -> dict | None:
+    if isinstance(term,rdflib.term.Literal):
+        if term.datatype == None:
+            return {"type": "literal", "value": str(term)}
+        return {"type": "typed-literal", "datatype": str(term.datatype), "value": str(term)}
+    if isinstance(term,rdflib.term.URIRef):
+        return {"type": "uri", "value": str(term)}
+    return None
@@ -1,5 +1,6 @@
 import os
 import logging
+import reprlib
 
 ####################
 # ENABLING LOGGING #
@@ -11,3 +12,52 @@ if "LOG_LEVEL" in os.environ:
 else:
     logger.setLevel(getattr(logging, "INFO"))
 LOG_LEVEL = logger.level
+
+
+####################
+# PAYLOAD LOGGING  #
+####################
+
+# payloads, such as queries, graph patterns, bindings and results, are logged at DEBUG level by separate
+# '<module>.payload' loggers, so that INFO request logs do not pay for formatting (large) payloads
+if "PAYLOAD_LOG_LEVEL" in os.environ:
+    PAYLOAD_LOG_LEVEL = getattr(logging, os.getenv("PAYLOAD_LOG_LEVEL"))
+else: # no payload log level, so use the general log level
+    PAYLOAD_LOG_LEVEL = LOG_LEVEL
+
+if "PAYLOAD_LOG_MAX_LENGTH" in os.environ:
+    try:
+        PAYLOAD_LOG_MAX_LENGTH = int(os.getenv("PAYLOAD_LOG_MAX_LENGTH"))
+    except ValueError:
+        raise Exception("Incorrect PAYLOAD_LOG_MAX_LENGTH => You should provide a positive integer in the environment variable PAYLOAD_LOG_MAX_LENGTH")
+    if PAYLOAD_LOG_MAX_LENGTH < 1:
+        raise Exception("Incorrect PAYLOAD_LOG_MAX_LENGTH => You should provide a positive integer in the environment variable PAYLOAD_LOG_MAX_LENGTH")
+else: # no maximum length, so log at most 2000 characters of a payload
+    PAYLOAD_LOG_MAX_LENGTH = 2000
+
+# a bounded representation only visits the first elements of large lists and dictionaries
+payload_repr = reprlib.Repr()
+payload_repr.maxlevel = 6
+payload_repr.maxlist = payload_repr.maxtuple = payload_repr.maxset = payload_repr.maxdict = 20
+payload_repr.maxstring = payload_repr.maxother = PAYLOAD_LOG_MAX_LENGTH
+
+
+def getPayloadLogger(name: str) -> logging.Logger:
+    payload_logger = logging.getLogger(name+".payload")
+    payload_logger.setLevel(PAYLOAD_LOG_LEVEL)
+    return payload_logger
+
+
+class Payload:
+    # wraps a payload for a log message, it is only formatted (and truncated) when the message is emitted
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload) -> None:
+        self.payload = payload
+
+    def __str__(self) -> str:
+        text = self.payload if isinstance(self.payload, str) else payload_repr.repr(self.payload)
+        if len(text) > PAYLOAD_LOG_MAX_LENGTH:
+            text = text[:PAYLOAD_LOG_MAX_LENGTH] + f"... ({len(text)-PAYLOAD_LOG_MAX_LENGTH} more characters)"
+        return text
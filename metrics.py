@@ -0,0 +1,144 @@
+# basic imports
+import os
+import time
+import logging
+import contextvars
+import logging_config as lc
+from contextlib import contextmanager
+
+# metrics imports
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, multiprocess
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+####################
+# ENABLING LOGGING #
+####################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(lc.LOG_LEVEL)
+
+
+###########################
+#   METRIC DEFINITIONS    #
+###########################
+
+# the stages of a request are, for example, parsing, decomposition, knowledge base existence checks,
+# knowledge interaction registration, asks, graph building, local evaluation and serialization
+STAGE_DURATION = Histogram("sparql_endpoint_stage_duration_seconds",
+                           "Duration of the stages of handling a request",
+                           ["stage"],
+                           buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+BINDINGS_RECEIVED = Counter("sparql_endpoint_bindings_received",
+                            "Number of bindings received from the knowledge network",
+                            ["interaction"])
+
+RESULT_BINDINGS = Counter("sparql_endpoint_result_bindings",
+                          "Number of bindings returned in query results")
+
+RESPONSE_BYTES = Counter("sparql_endpoint_response_bytes",
+                         "Number of bytes returned in query results",
+                         ["format"])
+
+
+# the execution trace of the current request, only when the request asks for a profile
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class CacheCollector:
+    # exports the statistics of a cache, such as the query cache, when the metrics are collected
+
+    def __init__(self, name: str, get_statistics) -> None:
+        self.name = name
+        self.get_statistics = get_statistics
+
+    def collect(self):
+        statistics = self.get_statistics()
+        for key in ["size", "maxsize", "weight"]:
+            gauge = GaugeMetricFamily(f"sparql_endpoint_{self.name}_{key}", f"Current {key} of the {self.name.replace('_',' ')}")
+            gauge.add_metric([], statistics[key])
+            yield gauge
+        for key in ["hits", "misses", "evictions"]:
+            counter = CounterMetricFamily(f"sparql_endpoint_{self.name}_{key}", f"Number of {key} of the {self.name.replace('_',' ')}")
+            counter.add_metric([], statistics[key])
+            yield counter
+
+
+###########################
+#    METRIC FUNCTIONS     #
+###########################
+
+@contextmanager
+def measureStage(stage: str):
+    # observe the duration of the stage, also when it fails, and add it to the trace of the request
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_DURATION.labels(stage).observe(duration)
+        trace = current_trace.get()
+        if trace is not None:
+            trace["stages"].append({"stage": stage, "seconds": duration})
+
+
+def startTrace() -> dict:
+    # the trace is shared with the tasks that are created for the request, e.g. to ask patterns concurrently
+    trace = {"decomposition": None, "asks": [], "graph_triples": None, "stages": []}
+    current_trace.set(trace)
+    return trace
+
+
+def traceAsk(pattern: str, bindings: list, answer: dict, seconds: float, shared: bool):
+    trace = current_trace.get()
+    if trace is not None:
+        trace["asks"].append({
+            "pattern": pattern,
+            # the bindings that are sent are truncated like the payloads in the logs
+            "bindings": str(lc.Payload(bindings)),
+            "bindings_in": len(bindings),
+            "bindings_out": len(answer.get("bindingSet", [])),
+            "seconds": seconds,
+            "shared": shared
+        })
+
+
+def countBindingsReceived(interaction: str, answer: dict):
+    bindings = answer.get("bindingSet", answer.get("resultBindingSet", []))
+    BINDINGS_RECEIVED.labels(interaction).inc(len(bindings))
+
+
+def countResultBindings(result: dict):
+    # the bindings of a streamed SELECT result are counted while they are written
+    bindings = result.get('results', {}).get('bindings')
+    if isinstance(bindings, list):
+        RESULT_BINDINGS.inc(len(bindings))
+    elif bindings is not None:
+        result['results']['bindings'] = countIteratedBindings(bindings)
+
+
+def countIteratedBindings(bindings):
+    for binding in bindings:
+        RESULT_BINDINGS.inc()
+        yield binding
+
+
+def countResponseBytes(chunks, format: str):
+    # count the bytes of a response while it is written
+    for chunk in chunks:
+        RESPONSE_BYTES.labels(format).inc(len(chunk))
+        yield chunk
+
+
+def registerCache(name: str, get_statistics):
+    REGISTRY.register(CacheCollector(name, get_statistics))
+
+
+def getMetrics() -> tuple[bytes, str]:
+    # with multiple workers, the metrics of all workers are combined from the files in PROMETHEUS_MULTIPROC_DIR,
+    # but the statistics of the caches are only known to each worker itself and are therefore left out
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,6 +1,9 @@
 # basic imports
 import os
 import json
+import asyncio
+import threading
+import re
 import string
 import pprint
 import requests
@@ -10,7 +13,7 @@ import logging_config as lc
 # graph imports
 import rdflib
 from rdflib.plugins.sparql.parser import parseQuery, parseUpdate
-from rdflib.plugins.sparql.sparql import Prologue
+from rdflib.plugins.sparql.sparql import Prologue, Query
 from rdflib.namespace import NamespaceManager
 from rdflib.plugins.sparql.algebra import translatePrologue, translatePName, translateQuery, translateUpdate, traverse, functools
 from rdflib.exceptions import ParserError
@@ -18,11 +21,14 @@ from rdflib.util import from_n3
 from rdflib import RDF, Graph, Namespace, URIRef, Literal
 
 # model imports
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, SkipValidation
+from typing import Any
 import itertools
 
 # import other py's from this repository
 import knowledge_network
+import metrics
+from cache import LRUCache
 
 
 ####################
@@ -31,8 +37,46 @@ import knowledge_network
 
 logger = logging.getLogger(__name__)
 logger.setLevel(lc.LOG_LEVEL)
+payload_logger = lc.getPayloadLogger(__name__)
 
 
+####################
+# ENVIRONMENT VARS #
+####################
+
+if "MAX_CONCURRENT_ASKS_PER_REQUEST" in os.environ:
+    try:
+        MAX_CONCURRENT_ASKS_PER_REQUEST = int(os.getenv("MAX_CONCURRENT_ASKS_PER_REQUEST"))
+    except ValueError:
+        raise Exception("Incorrect MAX_CONCURRENT_ASKS_PER_REQUEST => You should provide a positive integer in the environment variable MAX_CONCURRENT_ASKS_PER_REQUEST")
+    if MAX_CONCURRENT_ASKS_PER_REQUEST < 1:
+        raise Exception("Incorrect MAX_CONCURRENT_ASKS_PER_REQUEST => You should provide a positive integer in the environment variable MAX_CONCURRENT_ASKS_PER_REQUEST")
+else: # no maximum, so ask at most 8 graph patterns of a request at the same time
+    MAX_CONCURRENT_ASKS_PER_REQUEST = 8
+logger.info(f"MAX_CONCURRENT_ASKS_PER_REQUEST is set to {MAX_CONCURRENT_ASKS_PER_REQUEST}")
+
+if "QUERY_CACHE_SIZE" in os.environ:
+    try:
+        QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE"))
+    except ValueError:
+        raise Exception("Incorrect QUERY_CACHE_SIZE => You should provide a non-negative integer (0 disables the cache) in the environment variable QUERY_CACHE_SIZE")
+    if QUERY_CACHE_SIZE < 0:
+        raise Exception("Incorrect QUERY_CACHE_SIZE => You should provide a non-negative integer (0 disables the cache) in the environment variable QUERY_CACHE_SIZE")
+else: # no cache size, so keep at most 256 prepared queries
+    QUERY_CACHE_SIZE = 256
+logger.info(f"QUERY_CACHE_SIZE is set to {QUERY_CACHE_SIZE}")
+
+if "MAX_VALUES_COMBINATIONS" in os.environ:
+    try:
+        MAX_VALUES_COMBINATIONS = int(os.getenv("MAX_VALUES_COMBINATIONS"))
+    except ValueError:
+        raise Exception("Incorrect MAX_VALUES_COMBINATIONS => You should provide a positive integer in the environment variable MAX_VALUES_COMBINATIONS")
+    if MAX_VALUES_COMBINATIONS < 1:
+        raise Exception("Incorrect MAX_VALUES_COMBINATIONS => You should provide a positive integer in the environment variable MAX_VALUES_COMBINATIONS")
+else: # no maximum, so combine VALUES statements into at most 100000 bindings
+    MAX_VALUES_COMBINATIONS = 100000
+logger.info(f"MAX_VALUES_COMBINATIONS is set to {MAX_VALUES_COMBINATIONS}")
+
 ###################
 # GENERIC CLASSES #
 ###################
@@ -51,25 +95,74 @@ class RequestDecomposition(BaseModel):
 	values: list = []
 	insertPattern: list = []
 	subDecompositions: list = []
+	sliceStart: int = 0
+	sliceLength: int | None = None
+	bindingsLimit: int | None = None
+
+
+class DirectResult(BaseModel):
+	vars: list[str]
+	distinct: bool = False
+	offset: int = 0
+	limit: int | None = None
+
+
+class PreparedQuery(BaseModel):
+	model_config = ConfigDict(arbitrary_types_allowed=True)
+	query: Query
+	decomposition: RequestDecomposition
+	namespace_manager: NamespaceManager
+	# a query that only projects, deduplicates or slices its main graph pattern is answered directly from the bindings
+	direct_result: DirectResult | None = None
+	# rdflib keeps evaluation state in the query algebra, so a (cached) query can only be evaluated by one request at a time
+	evaluation_lock: SkipValidation[Any] = Field(default_factory=threading.Lock)
+
+
+#########################
+# GENERIC START-UP CODE #
+#########################
+
+# start an empty cache with a mapping between normalized query texts and their prepared queries
+query_cache = LRUCache(QUERY_CACHE_SIZE)
 	
 
 ##################
 # QUERY HANDLING #
 ##################
 
-def constructGraphFromKnowledgeNetwork(query: str, requester_id: str, gaps_enabled) -> tuple[Graph, list]:
+def prepareQuery(query: str) -> PreparedQuery:
+    # repeated queries skip the parsing, translation and decomposition by reusing the cached prepared query
+    if QUERY_CACHE_SIZE == 0:
+        return parseAndDecomposeQuery(query)
+    key = normalizeQueryText(query)
+    prepared_query = query_cache.get(key)
+    if prepared_query is not None:
+        logger.info(f"Reusing the prepared query from the query cache!")
+    else:
+        prepared_query = query_cache.put(key, parseAndDecomposeQuery(query))
+    logger.debug("Query cache statistics are: %s", query_cache.stats())
+    return prepared_query
+
+
+def getQueryCacheStatistics() -> dict:
+    # the hit, miss and eviction counters of the query cache
+    return query_cache.stats()
+
+
+def parseAndDecomposeQuery(query: str) -> PreparedQuery:
     # TEST query
     #query = "SELECT * WHERE {?s ?p ?o}"
     # first parse the query
     try:
-        parsed_query = parseQuery(query)
+        with metrics.measureStage("parsing"):
+            parsed_query = parseQuery(query)
     except Exception as e:
         # create a message that says that only SELECT queries are expected and raise that exception
         replaceable_string = "Expected {SelectQuery | ConstructQuery | DescribeQuery | AskQuery}"
         message = str(e).replace(replaceable_string,"Expected SelectQuery or AskQuery")
         raise Exception(message)
     
-    logger.info(f"Parsed query is: {parsed_query}")
+    payload_logger.debug("Parsed query is: %s", lc.Payload(parsed_query))
     # then determine whether the query is a SELECT query, because we only accept those!
     if not parsed_query[1].name == "SelectQuery" and not parsed_query[1].name == "AskQuery":
         raise Exception(f"Only SELECT or ASK queries are supported!")
@@ -81,90 +174,166 @@ def constructGraphFromKnowledgeNetwork(query: str, requester_id: str, gaps_enabl
     # then, check whether all prefixes in the query are defined in the prologue
     traverse(parsed_query[1], visitPost=functools.partial(translatePName, prologue=prologue))
 
-    # now, get the algebra from the query
-    algebra = translateQuery(parsed_query).algebra
-    logger.debug(f"Algebra of the query is: {algebra}")
+    # now, get the algebra from the query, the translated query is also used for the evaluation on the local graph
+    with metrics.measureStage("translation"):
+        translated_query = translateQuery(parsed_query)
+    algebra = translated_query.algebra
+    payload_logger.debug("Algebra of the query is: %s", lc.Payload(algebra))
         
     # decompose the query algebra and get the main BGP pattern, possible OPTIONAL patterns and possible VALUES statements
     try:
-        query_decomposition = decomposeRequest(algebra['p'], RequestDecomposition())
+        with metrics.measureStage("decomposition"):
+            query_decomposition = decomposeRequest(algebra['p'], RequestDecomposition())
     except Exception as e:
         raise Exception(f"Could not decompose query to get graph patterns, {e}")
 
     # deal with multiple VALUES clauses, combine them and delete incorrect combinations
     query_decomposition = combineValuesStatements(query_decomposition)
 
-    # now show the derived query decomposition
-    showRequestDecomposition(query_decomposition, prologue.namespace_manager)
+    # when it is safe, the slice of the query bounds the number of bindings that are used from the knowledge network
+    query_decomposition.bindingsLimit = deriveBindingsLimit(algebra, query_decomposition)
+
+    return PreparedQuery(query=translated_query, decomposition=query_decomposition, namespace_manager=prologue.namespace_manager,
+                         direct_result=deriveDirectResult(algebra))
+
+
+async def constructGraphFromKnowledgeNetwork(prepared_query: PreparedQuery, requester_id: str, gaps_enabled) -> tuple[Graph, list]:
+    # first show the derived query decomposition
+    showRequestDecomposition(prepared_query.decomposition, prepared_query.namespace_manager)
 
     # build up a graph (and optionally knowledge gaps) by executing the decomposition on the knowledge network
     graph = Graph()
     knowledge_gaps = []
-    graph, knowledge_gaps = buildGraphFromDecomposition(graph, query_decomposition, requester_id, gaps_enabled, knowledge_gaps)
+    with metrics.measureStage("graph_construction"):
+        graph, knowledge_gaps = await buildGraphFromDecomposition(graph, prepared_query.decomposition, requester_id, gaps_enabled, knowledge_gaps)
 
     logger.info(f"Knowledge network successfully responded to all the ask patterns!")
 
     return graph, knowledge_gaps
 
 
-def buildGraphFromDecomposition(graph: Graph, 
+async def askBindingsFromKnowledgeNetwork(prepared_query: PreparedQuery, requester_id: str, gaps_enabled) -> tuple[list, list]:
+    # first show the derived query decomposition
+    showRequestDecomposition(prepared_query.decomposition, prepared_query.namespace_manager)
+
+    # the bindings of the main graph pattern already are the answer, so no graph needs to be built
+    ask_limiter = asyncio.Semaphore(MAX_CONCURRENT_ASKS_PER_REQUEST)
+    bindings, knowledge_gaps = await askMainPatternBindings(prepared_query.decomposition, requester_id, gaps_enabled, ask_limiter)
+
+    logger.info(f"Knowledge network successfully responded to the main graph pattern!")
+
+    return bindings, knowledge_gaps
+
+
+async def buildGraphFromDecomposition(graph: Graph, 
                                 decomposition: RequestDecomposition, 
                                 requester_id: str, 
                                 gaps_enabled: bool, 
-                                knowledge_gaps: list) -> tuple[Graph, list]:
+                                knowledge_gaps: list,
+                                ask_limiter: asyncio.Semaphore = None) -> tuple[Graph, list]:
 
-    # first, ask the main graph pattern and add the bindings to the graph
-    if len(decomposition.mainPattern) > 0:
-        logger.info('A main graph pattern is being asked from the knowledge network!')
-        try:
-            pattern = decomposition.mainPattern
-            logger.info(f"Pattern that is asked: {pattern}")
-            bindings = [{}]
-            if len(decomposition.values) > 0:
-                bindings = decomposition.values[0]
-            logger.info(f"Bindings that accompany the ASK: {bindings}")
-            answer = knowledge_network.askPatternAtKnowledgeNetwork(requester_id, pattern, bindings, gaps_enabled)
-            logger.info(f"Received answer from the knowledge network: {answer}")
-            # extend the graph with the triples and values in the bindings
-            graph = buildGraphFromTriplesAndBindings(graph, pattern, answer["bindingSet"])
-            # if gaps_enabled and there are knowledge gaps, add them to the knowledge_gap return variable
-            if gaps_enabled:
-                if "knowledgeGaps" in answer.keys():
-                    if answer['knowledgeGaps'] != []:
-                        gap_pattern = knowledge_network.convertTriplesToPattern(pattern)
-                        logger.debug(f"Graph pattern for this knowledge gap: {gap_pattern}")
-                        knowledge_gap = {"pattern": gap_pattern, "gaps": answer['knowledgeGaps']}
-                        knowledge_gaps.append(knowledge_gap)
-                else: # knowledgeGaps is not in answer
-                    raise Exception("The knowledge network should support and return knowledge gaps!")
-        except Exception as e:
-            raise Exception(f"An error occurred when contacting the knowledge network: {e}")
-        logger.info(f"Knowledge network successfully responded to the main graph pattern!")
+    # the main graph pattern, the optional graph patterns (that are asked without bindings) and the sub decompositions
+    # are independent of each other, so they are asked concurrently with a maximum number of asks per request
+    if ask_limiter is None:
+        ask_limiter = asyncio.Semaphore(MAX_CONCURRENT_ASKS_PER_REQUEST)
 
-    # second, loop over the optional graph patterns and add the bindings to the graph
     try:
-        for pattern in decomposition.optionalPatterns:
-            logger.info('An optional graph pattern is being asked from the knowledge network!')
-            logger.info(f"Pattern that is asked: {pattern}")
-            answer = knowledge_network.askPatternAtKnowledgeNetwork(requester_id, pattern, [{}], gaps_enabled)
-            logger.info(f'Received answer from the knowledge network: {answer}')
-            # extend the graph with the triples and values in the bindings
-            graph = buildGraphFromTriplesAndBindings(graph, pattern, answer["bindingSet"])
-            logger.info(f"Knowledge network successfully responded to an optional graph pattern!")
+        async with asyncio.TaskGroup() as task_group:
+            # first, ask the main graph pattern and add the bindings to the graph
+            main_task = None
+            if len(decomposition.mainPattern) > 0:
+                main_task = task_group.create_task(askMainPattern(graph, decomposition, requester_id, gaps_enabled, ask_limiter))
+
+            # second, ask the optional graph patterns and add the bindings to the graph
+            for pattern in decomposition.optionalPatterns:
+                task_group.create_task(askOptionalPattern(graph, pattern, requester_id, gaps_enabled, ask_limiter))
+
+            # third, handle the sub decompositions to extend the graph and optionally knowledge gaps
+            sub_tasks = []
+            for decomp in decomposition.subDecompositions:
+                logger.info(f"A sub decomposition is being handled!")
+                sub_tasks.append(task_group.create_task(buildGraphFromDecomposition(graph, decomp, requester_id, gaps_enabled, [], ask_limiter)))
+    except ExceptionGroup as eg:
+        # when one of the asks fails, the other ones are cancelled and the first error is reported
+        raise eg.exceptions[0]
+
+    # collect the knowledge gaps in the order of the decomposition
+    if main_task is not None:
+        knowledge_gaps.extend(main_task.result())
+    for sub_task in sub_tasks:
+        knowledge_gaps.extend(sub_task.result()[1])
+    if len(sub_tasks) > 0:
+        logger.info(f"The sub decompositions have successfully been handled!")
+
+    return graph, knowledge_gaps
+
+
+async def askMainPattern(graph: Graph,
+                         decomposition: RequestDecomposition,
+                         requester_id: str,
+                         gaps_enabled: bool,
+                         ask_limiter: asyncio.Semaphore) -> list:
+    bindings, knowledge_gaps = await askMainPatternBindings(decomposition, requester_id, gaps_enabled, ask_limiter)
+    # only the bindings that are needed for the slice of the query are used
+    if decomposition.bindingsLimit is not None:
+        bindings = limitBindings(bindings, decomposition.bindingsLimit)
+    # extend the graph with the triples and values in the bindings
+    with metrics.measureStage("graph_building"):
+        buildGraphFromTriplesAndBindings(graph, decomposition.mainPattern, bindings)
+    logger.info(f"Knowledge network successfully responded to the main graph pattern!")
+
+    return knowledge_gaps
+
+
+async def askMainPatternBindings(decomposition: RequestDecomposition,
+                                 requester_id: str,
+                                 gaps_enabled: bool,
+                                 ask_limiter: asyncio.Semaphore) -> tuple[list, list]:
+    knowledge_gaps = []
+    logger.info('A main graph pattern is being asked from the knowledge network!')
+    try:
+        pattern = decomposition.mainPattern
+        payload_logger.debug("Pattern that is asked: %s", lc.Payload(pattern))
+        bindings = [{}]
+        if len(decomposition.values) > 0:
+            bindings = decomposition.values[0]
+        payload_logger.debug("Bindings that accompany the ASK: %s", lc.Payload(bindings))
+        async with ask_limiter:
+            answer = await knowledge_network.askPatternAtKnowledgeNetwork(requester_id, pattern, bindings, gaps_enabled)
+        payload_logger.debug("Received answer from the knowledge network: %s", lc.Payload(answer))
+        # if gaps_enabled and there are knowledge gaps, add them to the knowledge_gap return variable
+        if gaps_enabled:
+            if "knowledgeGaps" in answer.keys():
+                if answer['knowledgeGaps'] != []:
+                    gap_pattern = knowledge_network.convertTriplesToPattern(pattern)
+                    logger.debug(f"Graph pattern for this knowledge gap: {gap_pattern}")
+                    knowledge_gap = {"pattern": gap_pattern, "gaps": answer['knowledgeGaps']}
+                    knowledge_gaps.append(knowledge_gap)
+            else: # knowledgeGaps is not in answer
+                raise Exception("The knowledge network should support and return knowledge gaps!")
     except Exception as e:
         raise Exception(f"An error occurred when contacting the knowledge network: {e}")
 
-    # third, check if there sub-decompositions and loop over them to extend the graph and optionally knowledge gaps
+    return answer["bindingSet"], knowledge_gaps
+
+
+async def askOptionalPattern(graph: Graph,
+                             pattern: list,
+                             requester_id: str,
+                             gaps_enabled: bool,
+                             ask_limiter: asyncio.Semaphore):
+    logger.info('An optional graph pattern is being asked from the knowledge network!')
     try:
-        if len(decomposition.subDecompositions) > 0:
-            for decomp in decomposition.subDecompositions:
-                logger.info(f"A sub decomposition is being handled!")
-                graph, knowledge_gaps = buildGraphFromDecomposition(graph, decomp, requester_id, gaps_enabled, knowledge_gaps)
-                logger.info(f"The sub decomposition has successfully been handled!")
+        payload_logger.debug("Pattern that is asked: %s", lc.Payload(pattern))
+        async with ask_limiter:
+            answer = await knowledge_network.askPatternAtKnowledgeNetwork(requester_id, pattern, [{}], gaps_enabled)
+        payload_logger.debug("Received answer from the knowledge network: %s", lc.Payload(answer))
+        # extend the graph with the triples and values in the bindings
+        with metrics.measureStage("graph_building"):
+            buildGraphFromTriplesAndBindings(graph, pattern, answer["bindingSet"])
     except Exception as e:
         raise Exception(f"An error occurred when contacting the knowledge network: {e}")
-
-    return graph, knowledge_gaps
+    logger.info(f"Knowledge network successfully responded to an optional graph pattern!")
 
 
 ###################
@@ -190,7 +359,7 @@ def checkAndDecomposeUpdate(update: str) -> RequestDecomposition:
 
     # now, get the algebra from the update
     algebra = translateUpdate(parsed_update).algebra
-    logger.debug(f"Algebra of the update request is: {algebra}")
+    payload_logger.debug("Algebra of the update request is: %s", lc.Payload(algebra))
 
     # decompose the request algebra and get the INSERT and WHERE part (if present) of the request
     try:
@@ -207,7 +376,7 @@ def checkAndDecomposeUpdate(update: str) -> RequestDecomposition:
     return update_decomposition
 
 
-def executeUpdateOnKnowledgeNetwork(update_decomposition: RequestDecomposition, requester_id: str, gaps_enabled) -> str:
+async def executeUpdateOnKnowledgeNetwork(update_decomposition: RequestDecomposition, requester_id: str, gaps_enabled) -> str:
 
     # first, execute the where part patterns on the knowledge network and collect the returned bindings
     returned_bindings = []
@@ -216,13 +385,13 @@ def executeUpdateOnKnowledgeNetwork(update_decomposition: RequestDecomposition,
         logger.info('Main graph pattern is being asked from the knowledge network!')
         try:
             pattern = update_decomposition.mainPattern
-            logger.info(f"Pattern that is asked: {pattern}")
+            payload_logger.debug("Pattern that is asked: %s", lc.Payload(pattern))
             bindings = [{}]
             if len(update_decomposition.values) > 0:
                 bindings = update_decomposition.values[0]
-            logger.info(f"Bindings that accompany the ASK: {bindings}")
-            answer = knowledge_network.askPatternAtKnowledgeNetwork(requester_id, pattern, bindings, gaps_enabled)
-            logger.info(f"Received answer from the knowledge network: {answer}")
+            payload_logger.debug("Bindings that accompany the ASK: %s", lc.Payload(bindings))
+            answer = await knowledge_network.askPatternAtKnowledgeNetwork(requester_id, pattern, bindings, gaps_enabled)
+            payload_logger.debug("Received answer from the knowledge network: %s", lc.Payload(answer))
             returned_bindings = returned_bindings + answer['bindingSet']
         except Exception as e:
             raise Exception(f"An error occurred when contacting the knowledge network: {e}")
@@ -232,16 +401,16 @@ def executeUpdateOnKnowledgeNetwork(update_decomposition: RequestDecomposition,
         try:
             logger.info('Optional graph patterns are being asked from the knowledge network!')
             for pattern in update_decomposition.optionalPatterns:
-                logger.info(f"Pattern that is asked: {pattern}")
-                answer = knowledge_network.askPatternAtKnowledgeNetwork(requester_id, pattern, [{}], gaps_enabled)
-                logger.info(f'Received answer from the knowledge network: {answer}')
+                payload_logger.debug("Pattern that is asked: %s", lc.Payload(pattern))
+                answer = await knowledge_network.askPatternAtKnowledgeNetwork(requester_id, pattern, [{}], gaps_enabled)
+                payload_logger.debug("Received answer from the knowledge network: %s", lc.Payload(answer))
                 returned_bindings = returned_bindings + answer['bindingSet']
         except Exception as e:
             raise Exception(f"An error occurred when contacting the knowledge network: {e}")
         logger.info(f"Knowledge network successfully responded to all the ask patterns!")
     else:
         logger.info(f"No main graph pattern is derived from the query, so the result is empty!")
-    logger.info(f"Returned bindings is: {returned_bindings}")
+    payload_logger.debug("Returned bindings is: %s", lc.Payload(returned_bindings))
 
     # second, do a POST of the insert part pattern with the returned bindings
     try:
@@ -249,10 +418,10 @@ def executeUpdateOnKnowledgeNetwork(update_decomposition: RequestDecomposition,
         pattern = update_decomposition.insertPattern
         # filter the bindings based on the variables in the pattern
         post_bindings = filterBindingsOnPatternVariables(returned_bindings,pattern)
-        logger.info(f"Pattern that is posted: {pattern}")
-        logger.info(f"Bindings that accompany the POST: {post_bindings}")
-        answer = knowledge_network.postPatternAtKnowledgeNetwork(requester_id, pattern, post_bindings)
-        logger.info(f"Received answer from the knowledge network: {answer}")
+        payload_logger.debug("Pattern that is posted: %s", lc.Payload(pattern))
+        payload_logger.debug("Bindings that accompany the POST: %s", lc.Payload(post_bindings))
+        answer = await knowledge_network.postPatternAtKnowledgeNetwork(requester_id, pattern, post_bindings)
+        payload_logger.debug("Received answer from the knowledge network: %s", lc.Payload(answer))
     except Exception as e:
         raise Exception(f"An error occurred when contacting the knowledge network: {e}")
     logger.info(f"Knowledge network successfully responded to the insert pattern!")
@@ -264,6 +433,57 @@ def executeUpdateOnKnowledgeNetwork(update_decomposition: RequestDecomposition,
 # HELPER FUNCTIONS #
 ####################
 
+# the rest of an IRI after its '<', with the characters that SPARQL allows in an IRI reference
+IRI_REFERENCE = re.compile(r'[^<>"{}|^`\\\x00-\x20]*>')
+
+
+def normalizeQueryText(query: str) -> str:
+    # collapse each run of whitespace outside of IRIs, string literals and comments into a single space, so that queries
+    # that only differ in their layout share a cache entry, while literals remain untouched. a comment is kept as is
+    # together with the line break that ends it, because the rest of its line would otherwise become part of it.
+    # an IRI is kept as is, so that a quote or '#' within it does not start a literal or comment
+    normalized = []
+    quote = None
+    escaped = False
+    comment = False
+    pending_space = False
+    query = query.strip()
+    position = 0
+    while position < len(query):
+        character = query[position]
+        position += 1
+        if comment:
+            normalized.append(character)
+            if character in ("\n", "\r"):
+                comment = False
+        elif quote is not None:
+            normalized.append(character)
+            if escaped:
+                escaped = False
+            elif character == "\\":
+                escaped = True
+            elif character == quote:
+                quote = None
+        elif character.isspace():
+            pending_space = True
+        else:
+            if pending_space:
+                normalized.append(" ")
+                pending_space = False
+            normalized.append(character)
+            if character in ("'", '"'):
+                quote = character
+            elif character == "#":
+                comment = True
+            elif character == "<":
+                # a '<' is either the start of an IRI or a comparison operator
+                iri = IRI_REFERENCE.match(query, position)
+                if iri is not None:
+                    normalized.append(iri.group())
+                    position = iri.end()
+    return "".join(normalized)
+
+
 def decomposeRequest(algebra: dict, decomposition: RequestDecomposition) -> RequestDecomposition:
     # collect the pattern of triples from the algebra
     type = algebra.name
@@ -281,7 +501,7 @@ def decomposeRequest(algebra: dict, decomposition: RequestDecomposition) -> Requ
             decomposition = decomposeRequest(algebra['where'], decomposition)
         case "ToMultiSet":
             # the toMultiSet contains a set of values with <variable,value> pairs to be used in the graph patterns
-            logger.debug(f"Value clause before transforming to JSON is: {algebra['p']['res']}")
+            payload_logger.debug("Value clause before transforming to JSON is: %s", lc.Payload(algebra['p']['res']))
             values_clause = []
             for values_statement in algebra['p']['res']:
                 new_statement = {}
@@ -295,18 +515,24 @@ def decomposeRequest(algebra: dict, decomposition: RequestDecomposition) -> Requ
                         logger.debug(f"Value is a Literal and the datatype is {values_statement[key].datatype}")
                         new_statement[str(key)] = values_statement[key].n3()
                 values_clause.append(new_statement)
-            logger.debug(f"Value clause after transforming to JSON is: {values_clause}")
+            payload_logger.debug("Value clause after transforming to JSON is: %s", lc.Payload(values_clause))
             decomposition.values.append(values_clause)
         case "Filter":
             filter_type = algebra['expr'].name
             logger.debug(f"Filter expression is {filter_type}")
             match filter_type:
                 case "RelationalExpression":
-                    # it is a filter that checks a relation between a variable and a value => this can be ignored, continue with the rest
+                    # it is a filter that checks a relation between a variable and a value => continue with the rest
                     decomposition = decomposeRequest(algebra['p'], decomposition)
+                    # an equality with IRIs can be sent as values with the ask, the filter is still applied locally
+                    decomposition = addValuesFromFilter(algebra['expr'], decomposition)
                 case "ConditionalAndExpression":
-                    # it is a filter that checks multiple conditions in an AND setting => this can be ignored, continue with the rest
+                    # it is a filter that checks multiple conditions in an AND setting => continue with the rest
                     decomposition = decomposeRequest(algebra['p'], decomposition)
+                    # each equality with IRIs can be sent as values with the ask, the filter is still applied locally
+                    for expr in [algebra['expr']['expr']] + algebra['expr']['other']:
+                        if expr.name == "RelationalExpression":
+                            decomposition = addValuesFromFilter(expr, decomposition)
                 case "Builtin_isBLANK":
                     # it is a filter that checks whether the argument is a blank node => this can be ignored, continue with the rest
                     decomposition = decomposeRequest(algebra['p'], decomposition)
@@ -332,7 +558,9 @@ def decomposeRequest(algebra: dict, decomposition: RequestDecomposition) -> Requ
             # the project contains a part p that should be further processed
             decomposition = decomposeRequest(algebra['p'], decomposition)
         case "Slice":
-            # the slice contains a part p that should be further processed
+            # the slice is recorded to bound the answer and it contains a part p that should be further processed
+            decomposition.sliceStart = algebra['start']
+            decomposition.sliceLength = algebra['length']
             decomposition = decomposeRequest(algebra['p'], decomposition)
         case "Extend":
             # the extend contains a part p that should be further processed
@@ -349,6 +577,100 @@ def decomposeRequest(algebra: dict, decomposition: RequestDecomposition) -> Requ
     return decomposition
 
 
+def addValuesFromFilter(expr: dict, decomposition: RequestDecomposition) -> RequestDecomposition:
+    # a filter like ?x = <iri> or ?x IN (<iri>, ...) restricts the variable to the same values as a VALUES clause.
+    # only IRIs are used, because equality of literals is value based (e.g. 1 = 1.0) and cannot be sent as bindings
+    variable = expr['expr']
+    other = expr['other']
+    if expr['op'] == "=" and isinstance(other,rdflib.term.Variable):
+        variable, other = other, variable
+    if expr['op'] == "=":
+        iris = [other]
+    elif expr['op'] == "IN":
+        iris = list(other)
+    else:
+        return decomposition
+    if not isinstance(variable,rdflib.term.Variable) or not all(isinstance(iri,rdflib.term.URIRef) for iri in iris):
+        return decomposition
+    # the variable must occur in the main graph pattern that is asked with the values
+    if not any(variable in triple for triple in decomposition.mainPattern):
+        return decomposition
+    values_clause = [{str(variable): iri.n3()} for iri in dict.fromkeys(iris)]
+    payload_logger.debug("Filter is sent as values with the ask: %s", lc.Payload(values_clause))
+    decomposition.values.append(values_clause)
+    return decomposition
+
+
+def deriveDirectResult(algebra: dict) -> DirectResult | None:
+    # a SELECT query over a single graph pattern with at most a projection, DISTINCT and LIMIT/OFFSET
+    # has the bindings of the knowledge network as its answer, so it does not need a local evaluation
+    if algebra.name != "SelectQuery":
+        return None
+    part = algebra['p']
+    offset = 0
+    limit = None
+    distinct = False
+    if part.name == "Slice":
+        offset = part['start']
+        limit = part['length']
+        part = part['p']
+    if part.name == "Distinct":
+        distinct = True
+        part = part['p']
+    if part.name != "Project":
+        return None
+    vars = [str(var) for var in part['PV']]
+    part = part['p']
+    if part.name != "BGP" or len(part['triples']) == 0:
+        return None
+    # blank nodes in the pattern are not returned as bindings, so those queries are evaluated locally
+    for triple in part['triples']:
+        for element in triple:
+            if isinstance(element,rdflib.term.BNode):
+                return None
+    logger.debug(f"Query can be answered directly from the bindings of the knowledge network")
+    return DirectResult(vars=vars, distinct=distinct, offset=offset, limit=limit)
+
+
+def deriveBindingsLimit(algebra: dict, decomposition: RequestDecomposition) -> int | None:
+    # every distinct binding of the main graph pattern results in at least one solution of the query, unless
+    # the solutions are filtered, ordered, aggregated or deduplicated, or other patterns are united with it.
+    # only when none of these is the case, the bindings beyond the slice of the query are not needed
+    if algebra.name != "SelectQuery" or decomposition.sliceLength is None or len(decomposition.subDecompositions) > 0:
+        return None
+    part = algebra['p']
+    if part.name != "Slice" or part['p'].name != "Project":
+        return None
+    parts = [part['p']['p']]
+    while len(parts) > 0:
+        part = parts.pop()
+        match part.name:
+            case "BGP" | "ToMultiSet":
+                pass
+            case "Join" | "LeftJoin":
+                parts.extend([part['p1'], part['p2']])
+            case _:
+                return None
+    logger.debug(f"Bindings of the main graph pattern are limited by the slice of the query")
+    return decomposition.sliceStart + decomposition.sliceLength
+
+
+def limitBindings(bindings: list, limit: int) -> list:
+    # identical bindings result in the same solutions, so take the first distinct bindings up to the limit
+    limited_bindings = []
+    seen = set()
+    for binding in bindings:
+        if len(limited_bindings) >= limit:
+            break
+        key = tuple(sorted(binding.items()))
+        if key not in seen:
+            seen.add(key)
+            limited_bindings.append(binding)
+    if len(limited_bindings) < len(bindings):
+        logger.info(f"Only {len(limited_bindings)} of the {len(bindings)} bindings are needed for the slice of the query")
+    return limited_bindings
+
+
 def filterBindingsOnPatternVariables(bindings: list , pattern: list) -> list:
     variables = []
     for t in pattern:
@@ -364,7 +686,7 @@ def filterBindingsOnPatternVariables(bindings: list , pattern: list) -> list:
             if key in variables:
                 filtered_binding[key] = b[key]
         filtered_bindings.append(filtered_binding)
-    logger.debug(f"Filtered bindings are: {filtered_bindings}")
+    payload_logger.debug("Filtered bindings are: %s", lc.Payload(filtered_bindings))
     
     return filtered_bindings
 
@@ -373,30 +695,19 @@ def combineValuesStatements(decomposition: RequestDecomposition) -> RequestDecom
     # if there are VALUES clause elements, combine them
     if len(decomposition.values) > 1:
         logger.info(f"Now combining the VALUES statements")
-        # derive all combinations of VALUES clause elements
-        logger.debug(f"Query decomposition VALUES is: {decomposition.values}")
-        values_combinations = list(itertools.product(*decomposition.values))
+        payload_logger.debug("Query decomposition VALUES is: %s", lc.Payload(decomposition.values))
+        # join the VALUES statements one by one, so that only correct value combinations are derived
+        values_combinations = iter(decomposition.values[0])
+        for values_statement in decomposition.values[1:]:
+            values_combinations = joinValuesStatements(values_combinations, values_statement)
         correct_values_combinations = []
-        # delete all incorrect value combinations
         for values_combination in values_combinations:
-            # check if this values combination is correct
-            correct = True
-            correct_values_combination = {}
-            # loop over the elements in the values combination
-            for element in values_combination:
-                for key in element.keys():
-                    logger.debug(f"Value for {key} is: {element[key]}")
-                    if key not in correct_values_combination.keys():
-                        correct_values_combination[key] = element[key]
-                    else:
-                        if correct_values_combination[key] != element[key]:
-                            # this values combination is inconsistent, because one key must only have one value
-                            correct = False
-            if correct:
-                correct_values_combinations.append(correct_values_combination)
-    
+            if len(correct_values_combinations) >= MAX_VALUES_COMBINATIONS:
+                raise Exception(f"The VALUES statements result in more than {MAX_VALUES_COMBINATIONS} value combinations")
+            correct_values_combinations.append(values_combination)
+
         decomposition.values = [correct_values_combinations]
-        logger.debug(f"Values after combining are: {decomposition.values}")
+        payload_logger.debug("Values after combining are: %s", lc.Payload(decomposition.values))
         
     # if there are sub decompositions, do check if they have VALUES statements to be combined
     subDecomp_combined_values = []
@@ -407,27 +718,77 @@ def combineValuesStatements(decomposition: RequestDecomposition) -> RequestDecom
     return decomposition
 
 
+def joinValuesStatements(values_combinations, values_statement: list):
+    # a values combination is correct when the values of its shared variables are the same (a variable without
+    # value (UNDEF) matches any value). the elements of the statement are grouped by their variables and each group
+    # is indexed on the variables it shares with a combination, so that only matching elements are visited
+    groups = {}
+    for position, element in enumerate(values_statement):
+        groups.setdefault(frozenset(element.keys()), []).append(position)
+    indexes = {}
+    for values_combination in values_combinations:
+        matches = []
+        for variables, positions in groups.items():
+            shared = tuple(sorted(variables.intersection(values_combination.keys())))
+            index = indexes.get((variables, shared))
+            if index is None:
+                index = {}
+                for position in positions:
+                    index.setdefault(tuple(values_statement[position][key] for key in shared), []).append(position)
+                indexes[(variables, shared)] = index
+            matches.extend(index.get(tuple(values_combination[key] for key in shared), []))
+        # keep the order of the elements in the VALUES statement
+        for position in sorted(matches):
+            yield values_combination | values_statement[position]
+
+
 def buildGraphFromTriplesAndBindings(graph: Graph, triples: list, bindings: list) -> Graph:
-    for binding in bindings:
-        logger.debug(f"Binding returned from the knowledge network: {binding}")
-        for triple in triples:
-            #logger.info(f"Triple in pattern for which the binding holds: {triple}")
-            bound_triple = ()
-            for element in triple:
-                if isinstance(element,rdflib.term.Variable):
-                    value = binding[str(element)]
-                    #logger.debug(f"Element in triple of pattern is '{element}' with binding value {value}")
-                    uri = from_n3(value.encode('unicode_escape').decode('unicode_escape'))
-                    #logger.debug(f"Element in new triple with from_n3 encoding is {uri}")
-                    bound_triple += (uri,)
-                else:
-                    bound_triple += (element,)
-            logger.debug(f"Triple that will be added to the graph is: {bound_triple}")
-            graph.add(bound_triple)
+    # the same values are returned in many bindings, so each distinct value is converted to a term only once
+    terms = {}
+    def toTerm(value: str):
+        term = terms.get(value)
+        if term is None:
+            term = from_n3(value.encode('unicode_escape').decode('unicode_escape'))
+            terms[value] = term
+        return term
+
+    # determine once per triple in the pattern which of its elements are variables that need to be bound
+    templates = [tuple((str(element) if isinstance(element,rdflib.term.Variable) else None, element) for element in triple)
+                 for triple in triples]
+    debug = payload_logger.isEnabledFor(logging.DEBUG)
+
+    def boundQuads():
+        for binding in bindings:
+            if debug:
+                payload_logger.debug("Binding returned from the knowledge network: %s", lc.Payload(binding))
+            for template in templates:
+                bound_triple = tuple(toTerm(binding[var]) if var is not None else element for var, element in template)
+                if debug:
+                    payload_logger.debug("Triple that will be added to the graph is: %s", lc.Payload(bound_triple))
+                yield bound_triple + (graph,)
+
+    # add all bound triples to the graph in bulk
+    graph.addN(boundQuads())
     return graph
 
 
+def describeRequestDecomposition(qd: RequestDecomposition, nm: NamespaceManager) -> dict:
+    # the decomposition with its patterns in N3, e.g. to be returned in the profile of a request
+    def describePattern(pattern: list) -> list:
+        return [" ".join(element.n3(namespace_manager = nm) for element in triple) for triple in pattern]
+    return {
+        "mainPattern": describePattern(qd.mainPattern),
+        "optionalPatterns": [describePattern(p) for p in qd.optionalPatterns],
+        "valuesCombinations": [len(vc) for vc in qd.values],
+        "insertPattern": describePattern(qd.insertPattern),
+        "subDecompositions": [describeRequestDecomposition(decomp, nm) for decomp in qd.subDecompositions]
+    }
+
+
 def showRequestDecomposition(qd: RequestDecomposition, nm: NamespaceManager):
+    # the patterns are only written out when payloads are logged
+    if not payload_logger.isEnabledFor(logging.DEBUG):
+        return
     pattern = ""
     for triple in qd.mainPattern:
         bound_triple = "    "
@@ -436,7 +797,7 @@ def showRequestDecomposition(qd: RequestDecomposition, nm: NamespaceManager):
         bound_triple += "\n"
         pattern += bound_triple
     if pattern != "":
-        logger.info(f"Derived the following main graph pattern from the request:\n{pattern}")
+        payload_logger.debug("Derived the following main graph pattern from the request:\n%s", lc.Payload(pattern))
 		
     for p in qd.optionalPatterns:
         pattern = ""
@@ -446,7 +807,7 @@ def showRequestDecomposition(qd: RequestDecomposition, nm: NamespaceManager):
                 bound_triple += element.n3(namespace_manager = nm) + " "
             bound_triple += "\n"
             pattern += bound_triple
-        logger.info(f"Derived the following optional graph pattern from the request:\n{pattern}")
+        payload_logger.debug("Derived the following optional graph pattern from the request:\n%s", lc.Payload(pattern))
     
     for vc in qd.values:
         values_clause = ""
@@ -462,7 +823,7 @@ def showRequestDecomposition(qd: RequestDecomposition, nm: NamespaceManager):
             counter += 1
             if counter != len(vc):
                 values_clause += "        OR\n"
-        logger.info(f"Derived the following values clause from the request: \n{values_clause}")
+        payload_logger.debug("Derived the following values clause from the request: \n%s", lc.Payload(values_clause))
 
     pattern = ""
     for triple in qd.insertPattern:
@@ -472,7 +833,7 @@ def showRequestDecomposition(qd: RequestDecomposition, nm: NamespaceManager):
         bound_triple += "\n"
         pattern += bound_triple
     if pattern != "":
-        logger.info(f"Derived the following insert pattern from the request:\n{pattern}")
+        payload_logger.debug("Derived the following insert pattern from the request:\n%s", lc.Payload(pattern))
 
     for decomp in qd.subDecompositions:
         showRequestDecomposition(decomp,nm)
@@ -0,0 +1,180 @@
+# basic imports
+import io
+import csv
+import orjson
+import logging
+import logging_config as lc
+from xml.sax.saxutils import escape, quoteattr
+
+# enable logging
+logger = logging.getLogger(__name__)
+logger.setLevel(lc.LOG_LEVEL)
+
+
+####################################
+#     RESULT FORMAT DEFINITIONS    #
+####################################
+
+# the media types of the result formats, the first one is used for the response
+RESULT_FORMATS = {
+    "json": ["application/json", "application/sparql-results+json"],
+    "csv": ["text/csv"],
+    "tsv": ["text/tab-separated-values"],
+    "xml": ["application/sparql-results+xml", "application/xml"]
+}
+
+# the number of bindings that are written at once
+CHUNK_SIZE = 1000
+
+
+####################################
+#      CONTENT NEGOTIATION         #
+####################################
+
+def negotiateResultFormat(accept_header: str, formats: list) -> str | None:
+    # return the format with the highest quality in the accept header that is in the given formats
+    media_types = {media_type: format for format in formats for media_type in RESULT_FORMATS[format]}
+    best_format = None
+    best_quality = 0
+    for accepted in accept_header.split(","):
+        parts = accepted.strip().split(";")
+        media_type = parts[0].strip().lower()
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _, value = parameter.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if media_type in ["*/*", "application/*"]:
+            # any format is fine, so prefer the first format
+            format = formats[0]
+        else:
+            format = media_types.get(media_type)
+        if format is not None and quality > best_quality:
+            best_format = format
+            best_quality = quality
+    return best_format
+
+
+def getMediaType(format: str) -> str:
+    return RESULT_FORMATS[format][0]
+
+
+####################################
+#         RESULT WRITERS           #
+####################################
+
+def writeResult(result: dict, format: str):
+    # write the result in chunks of bytes, the bindings are only reformatted when they are written
+    match format:
+        case "csv":
+            return writeCSV(result)
+        case "tsv":
+            return writeTSV(result)
+        case "xml":
+            return writeXML(result)
+        case _:
+            return writeJSON(result)
+
+
+def chunked(bindings):
+    chunk = []
+    for binding in bindings:
+        chunk.append(binding)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def writeJSON(result: dict):
+    # the SPARQL 1.1 Query Results JSON Format, serialized with orjson
+    if 'results' not in result.keys():
+        yield orjson.dumps(result)
+        return
+    yield b'{"head":' + orjson.dumps(result['head']) + b',"results":{"bindings":['
+    separator = b""
+    for chunk in chunked(result['results']['bindings']):
+        yield separator + b",".join(orjson.dumps(binding) for binding in chunk)
+        separator = b","
+    yield b"]}"
+    # other parts of the result, such as knowledge gaps, follow the bindings
+    for key, value in result.items():
+        if key not in ['head', 'results']:
+            yield b"," + orjson.dumps(key) + b":" + orjson.dumps(value)
+    yield b"}"
+
+
+def writeCSV(result: dict):
+    # the SPARQL 1.1 Query Results CSV Format, which only contains the lexical values of the terms
+    if 'results' not in result.keys():
+        yield f"_askResult\r\n{str(result['boolean']).lower()}\r\n".encode()
+        return
+    vars = result['head']['vars']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\r\n")
+    writer.writerow(vars)
+    yield buffer.getvalue().encode()
+    for chunk in chunked(result['results']['bindings']):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\r\n")
+        writer.writerows([[binding[var]['value'] if var in binding else "" for var in vars] for binding in chunk])
+        yield buffer.getvalue().encode()
+
+
+def writeTSV(result: dict):
+    # the SPARQL 1.1 Query Results TSV Format, which contains the terms in their Turtle/N-Triples syntax
+    if 'results' not in result.keys():
+        yield f"?_askResult\n{str(result['boolean']).lower()}\n".encode()
+        return
+    vars = result['head']['vars']
+    yield ("\t".join("?"+var for var in vars) + "\n").encode()
+    for chunk in chunked(result['results']['bindings']):
+        lines = ["\t".join(reformatTermIntoTSV(binding[var]) if var in binding else "" for var in vars) for binding in chunk]
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def reformatTermIntoTSV(term: dict) -> str:
+    if term['type'] == "uri":
+        return f"<{term['value']}>"
+    if term['type'] == "bnode":
+        return f"_:{term['value']}"
+    value = term['value'].replace("\\","\\\\").replace('"','\\"').replace("\n","\\n").replace("\r","\\r").replace("\t","\\t")
+    if 'datatype' in term.keys():
+        return f'"{value}"^^<{term["datatype"]}>'
+    if 'xml:lang' in term.keys():
+        return f'"{value}"@{term["xml:lang"]}'
+    return f'"{value}"'
+
+
+def writeXML(result: dict):
+    # the SPARQL Query Results XML Format
+    yield '<?xml version="1.0"?>\n<sparql xmlns="http://www.w3.org/2005/sparql-results#">\n'.encode()
+    if 'results' not in result.keys():
+        yield f"  <head/>\n  <boolean>{str(result['boolean']).lower()}</boolean>\n</sparql>\n".encode()
+        return
+    vars = result['head']['vars']
+    yield ("  <head>\n" + "".join(f"    <variable name={quoteattr(var)}/>\n" for var in vars) + "  </head>\n  <results>\n").encode()
+    for chunk in chunked(result['results']['bindings']):
+        yield "".join(reformatBindingIntoXML(binding) for binding in chunk).encode()
+    yield "  </results>\n</sparql>\n".encode()
+
+
+def reformatBindingIntoXML(binding: dict) -> str:
+    xml = "    <result>\n"
+    for var, term in binding.items():
+        if term['type'] == "uri":
+            value = f"<uri>{escape(term['value'])}</uri>"
+        elif term['type'] == "bnode":
+            value = f"<bnode>{escape(term['value'])}</bnode>"
+        elif 'datatype' in term.keys():
+            value = f"<literal datatype={quoteattr(term['datatype'])}>{escape(term['value'])}</literal>"
+        elif 'xml:lang' in term.keys():
+            value = f"<literal xml:lang={quoteattr(term['xml:lang'])}>{escape(term['value'])}</literal>"
+        else:
+            value = f"<literal>{escape(term['value'])}</literal>"
+        xml += f"      <binding name={quoteattr(var)}>{value}</binding>\n"
+    return xml + "    </result>\n"
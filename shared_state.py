@@ -0,0 +1,194 @@
+# basic imports
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+import logging_config as lc
+import functools
+import anyio
+from contextlib import contextmanager
+
+####################
+# ENABLING LOGGING #
+####################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(lc.LOG_LEVEL)
+
+
+###################
+# GENERIC CLASSES #
+###################
+
+def in_thread(method):
+    # a statement might wait for the write lock of the database that another worker holds, so the methods that are
+    # called while handling requests run in a separate thread, one at a time, instead of blocking the event loop
+    @functools.wraps(method)
+    async def run_in_thread(self, *args):
+        return await anyio.to_thread.run_sync(functools.partial(method, self, *args), limiter=self._limiter)
+    return run_in_thread
+
+
+class SharedState:
+    # the knowledge bases and knowledge interactions that are registered by the worker processes of the endpoint
+    # on the same node, kept in an SQLite database, so that the workers use the same knowledge base of a requester.
+    # a knowledge base is claimed by the worker that registers it, while the other workers wait and then use it,
+    # and it is unregistered by the last worker that uses it, while the other workers wait until it is gone
+
+    def __init__(self, path: str, stale_after: float = 30) -> None:
+        self.path = path
+        self.pid = os.getpid()
+        # a claim of a worker that did not finish (un)registering its knowledge base in time can be taken over
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._limiter = anyio.CapacityLimiter(1)
+        self._connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._transaction() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY)")
+            c.execute("CREATE TABLE IF NOT EXISTS knowledge_bases (kb_id TEXT PRIMARY KEY, state TEXT, owner INTEGER, updated_at REAL)")
+            c.execute("CREATE TABLE IF NOT EXISTS knowledge_base_users (kb_id TEXT, pid INTEGER, PRIMARY KEY (kb_id, pid))")
+            c.execute("CREATE TABLE IF NOT EXISTS knowledge_interactions (kb_id TEXT, key TEXT, ki_id TEXT, PRIMARY KEY (kb_id, key))")
+        self.join_workers()
+
+    @contextmanager
+    def _transaction(self):
+        # an immediate transaction holds the write lock of the database, so that the workers do not interleave
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _remove_dead_workers(self, c: sqlite3.Connection):
+        for (pid,) in c.execute("SELECT pid FROM workers").fetchall():
+            if pid != self.pid and not is_alive(pid):
+                c.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+
+    def join_workers(self) -> bool:
+        # the first worker starts with an empty state, because the state of workers that are gone cannot be trusted
+        with self._transaction() as c:
+            self._remove_dead_workers(c)
+            first = c.execute("SELECT COUNT(*) FROM workers WHERE pid != ?", (self.pid,)).fetchone()[0] == 0
+            if first:
+                c.execute("DELETE FROM knowledge_bases")
+                c.execute("DELETE FROM knowledge_base_users")
+                c.execute("DELETE FROM knowledge_interactions")
+            c.execute("INSERT OR IGNORE INTO workers VALUES (?)", (self.pid,))
+        logger.info(f"Worker {self.pid} joined the shared state at {self.path} as {'first' if first else 'additional'} worker")
+        return first
+
+    @in_thread
+    def leave_workers(self) -> bool:
+        # returns whether this was the last worker, which should then unregister the knowledge bases
+        with self._transaction() as c:
+            c.execute("DELETE FROM workers WHERE pid = ?", (self.pid,))
+            self._remove_dead_workers(c)
+            last = c.execute("SELECT COUNT(*) FROM workers").fetchone()[0] == 0
+        logger.info(f"Worker {self.pid} left the shared state at {self.path} {'as last worker' if last else 'while other workers remain'}")
+        return last
+
+    @in_thread
+    def claim_knowledge_base(self, kb_id: str) -> str:
+        # returns "claimed" when this worker should register the knowledge base, "registered" when this worker
+        # can use it, or "registering" or "unregistering" when this worker should wait for another worker
+        now = time.time()
+        with self._transaction() as c:
+            row = c.execute("SELECT state, updated_at FROM knowledge_bases WHERE kb_id = ?", (kb_id,)).fetchone()
+            if row is None or (row[0] != "registered" and now - row[1] > self.stale_after):
+                c.execute("INSERT OR REPLACE INTO knowledge_bases VALUES (?, 'registering', ?, ?)", (kb_id, self.pid, now))
+                return "claimed"
+            if row[0] == "registered":
+                c.execute("INSERT OR IGNORE INTO knowledge_base_users VALUES (?, ?)", (kb_id, self.pid))
+            return row[0]
+
+    @in_thread
+    def complete_knowledge_base(self, kb_id: str):
+        with self._transaction() as c:
+            c.execute("UPDATE knowledge_bases SET state = 'registered', updated_at = ? WHERE kb_id = ?", (time.time(), kb_id))
+            c.execute("INSERT OR IGNORE INTO knowledge_base_users VALUES (?, ?)", (kb_id, self.pid))
+
+    @in_thread
+    def release_knowledge_base(self, kb_id: str):
+        with self._transaction() as c:
+            c.execute("DELETE FROM knowledge_bases WHERE kb_id = ?", (kb_id,))
+            c.execute("DELETE FROM knowledge_base_users WHERE kb_id = ?", (kb_id,))
+            c.execute("DELETE FROM knowledge_interactions WHERE kb_id = ?", (kb_id,))
+
+    @in_thread
+    def release_unknown_knowledge_base(self, kb_id: str):
+        # a registered knowledge base that is unknown at the knowledge network is forgotten, so that it is claimed again
+        with self._transaction() as c:
+            if c.execute("DELETE FROM knowledge_bases WHERE kb_id = ? AND state = 'registered'", (kb_id,)).rowcount > 0:
+                c.execute("DELETE FROM knowledge_base_users WHERE kb_id = ?", (kb_id,))
+                c.execute("DELETE FROM knowledge_interactions WHERE kb_id = ?", (kb_id,))
+
+    @in_thread
+    def leave_knowledge_base(self, kb_id: str) -> bool:
+        # returns whether this was the last worker that used the knowledge base, which should then unregister it.
+        # the knowledge base remains claimed while it is unregistered, so that no other worker uses it in the meantime
+        with self._transaction() as c:
+            c.execute("DELETE FROM knowledge_base_users WHERE kb_id = ? AND pid = ?", (kb_id, self.pid))
+            for (pid,) in c.execute("SELECT pid FROM knowledge_base_users WHERE kb_id = ?", (kb_id,)).fetchall():
+                if is_alive(pid):
+                    return False
+                c.execute("DELETE FROM knowledge_base_users WHERE kb_id = ? AND pid = ?", (kb_id, pid))
+            last = c.execute("UPDATE knowledge_bases SET state = 'unregistering', owner = ?, updated_at = ? WHERE kb_id = ? AND state = 'registered'",
+                             (self.pid, time.time(), kb_id)).rowcount > 0
+            if last:
+                c.execute("DELETE FROM knowledge_interactions WHERE kb_id = ?", (kb_id,))
+        return last
+
+    @in_thread
+    def complete_unregistration(self, kb_id: str):
+        with self._transaction() as c:
+            c.execute("DELETE FROM knowledge_bases WHERE kb_id = ? AND state = 'unregistering' AND owner = ?", (kb_id, self.pid))
+
+    @in_thread
+    def knowledge_base_ids(self) -> list:
+        with self._transaction() as c:
+            return [kb_id for (kb_id,) in c.execute("SELECT kb_id FROM knowledge_bases").fetchall()]
+
+    @in_thread
+    def get_knowledge_interaction(self, kb_id: str, key: tuple) -> str | None:
+        with self._transaction() as c:
+            row = c.execute("SELECT ki_id FROM knowledge_interactions WHERE kb_id = ? AND key = ?", (kb_id, json.dumps(key))).fetchone()
+        return row[0] if row is not None else None
+
+    @in_thread
+    def put_knowledge_interaction(self, kb_id: str, key: tuple, ki_id: str) -> str:
+        # store the knowledge interaction, unless another worker already stored one for the key: that one is returned
+        with self._transaction() as c:
+            c.execute("INSERT OR IGNORE INTO knowledge_interactions VALUES (?, ?, ?)", (kb_id, json.dumps(key), ki_id))
+            return c.execute("SELECT ki_id FROM knowledge_interactions WHERE kb_id = ? AND key = ?", (kb_id, json.dumps(key))).fetchone()[0]
+
+    @in_thread
+    def remove_knowledge_interaction(self, kb_id: str, key: tuple, ki_id: str):
+        with self._transaction() as c:
+            c.execute("DELETE FROM knowledge_interactions WHERE kb_id = ? AND key = ? AND ki_id = ?", (kb_id, json.dumps(key), ki_id))
+
+    @in_thread
+    def clear(self):
+        with self._transaction() as c:
+            c.execute("DELETE FROM knowledge_bases")
+            c.execute("DELETE FROM knowledge_base_users")
+            c.execute("DELETE FROM knowledge_interactions")
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,198 @@
+import os
+import sys
+import logging
+import random
+import itertools
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+import request_processor
+import result_writer
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# ASSUMPTIONS:
+# - These tests only check functions of the endpoint that do not call the knowledge network,
+#   but the environment variables for the knowledge network should still be set
+
+# When testing in terminal, add environment variables to the command:
+# KNOWLEDGE_ENGINE_URL=http://localhost:8280/rest KNOWLEDGE_BASE_ID_PREFIX=https://test-sparql-endpoint/ LOG_LEVEL=DEBUG python test_functions.py
+
+# Prepares a query without using the cache of prepared queries, so that a test sees the current settings
+def prepare(query: str) -> request_processor.PreparedQuery:
+    return request_processor.parseAndDecomposeQuery(query)
+
+
+# Testing the normalization of queries into cache keys
+def test_normalize_query_text():
+    # queries that only differ in their layout share the same text
+    query = "SELECT  *\n  WHERE {\t?s <http://p> ?o }"
+    assert request_processor.normalizeQueryText(query) == "SELECT * WHERE { ?s <http://p> ?o }"
+    # whitespace in literals is kept
+    query = "SELECT * WHERE { ?s <http://p> \"a  b\" }"
+    assert request_processor.normalizeQueryText(query) == query
+    # a comment keeps the line break that ends it, so that the rest of the query does not become part of it
+    with_line_break = "SELECT * WHERE {?s <http://p> ?o} # first page\nLIMIT 1"
+    without_line_break = "SELECT * WHERE {?s <http://p> ?o} # first page LIMIT 1"
+    assert request_processor.normalizeQueryText(with_line_break) != request_processor.normalizeQueryText(without_line_break)
+    assert request_processor.normalizeQueryText(with_line_break).endswith("# first page\nLIMIT 1")
+    # and the cached queries are therefore different as well
+    assert request_processor.prepareQuery(with_line_break) is not request_processor.prepareQuery(without_line_break)
+    # a quote or '#' within an IRI does not start a literal or comment, so the layout after it is still normalized
+    query = "SELECT * WHERE { ?s <http://example.org/it's> ?o .  ?s <http://p> \"a  b\" }"
+    assert request_processor.normalizeQueryText(query) == "SELECT * WHERE { ?s <http://example.org/it's> ?o . ?s <http://p> \"a  b\" }"
+    query = "SELECT * WHERE { ?s <http://example.org/a#b> ?o .\n  ?s <http://p> ?o }"
+    assert request_processor.normalizeQueryText(query) == "SELECT * WHERE { ?s <http://example.org/a#b> ?o . ?s <http://p> ?o }"
+    # while a '<' that is a comparison operator does not start an IRI
+    query = "SELECT * WHERE { ?s <http://p> ?o FILTER(?o < 3 || ?o = \"x > y  z\") }"
+    assert request_processor.normalizeQueryText(query) == query
+    logger.info("Query normalization test successful!\n")
+
+
+# Testing the combination of VALUES statements
+def test_join_values_statements():
+    # the combinations that are derived should be the same as the consistent combinations of all elements
+    def combine_all(statements):
+        combinations = []
+        for elements in itertools.product(*statements):
+            combination = {}
+            if all(combination.setdefault(key, element[key]) == element[key] for element in elements for key in element):
+                combinations.append(combination)
+        return combinations
+    a, b, c = "<http://example.org/a>", "<http://example.org/b>", "<http://example.org/c>"
+    # shared variables, an element with UNDEF (the variable is missing) and partly shared variables
+    statements = [
+        [{"x": a, "y": b}, {"x": b}, {"y": c}],
+        [{"x": a}, {"x": c, "z": a}, {"z": b}],
+        [{"y": b, "z": a}, {"y": c}, {}]
+    ]
+    combinations = iter(statements[0])
+    for statement in statements[1:]:
+        combinations = request_processor.joinValuesStatements(combinations, statement)
+    assert list(combinations) == combine_all(statements)
+    # and for many random statements
+    random.seed(42)
+    terms = [a, b, c, None]
+    for _ in range(200):
+        statements = [[{var: term for var in random.sample(["x", "y", "z"], random.randint(0, 3)) if (term := random.choice(terms)) is not None}
+                       for _ in range(random.randint(1, 4))] for _ in range(random.randint(2, 4))]
+        combinations = iter(statements[0])
+        for statement in statements[1:]:
+            combinations = request_processor.joinValuesStatements(combinations, statement)
+        assert list(combinations) == combine_all(statements)
+    # the VALUES statements of a query are combined into a single VALUES statement
+    query = """SELECT * WHERE { ?x <http://example.org/p> ?y .
+        VALUES ?x { <http://example.org/a> <http://example.org/b> }
+        VALUES (?x ?y) { (<http://example.org/a> UNDEF) (<http://example.org/c> <http://example.org/c>) } }"""
+    values = prepare(query).decomposition.values
+    assert values == [[{"x": a}]]
+    # the number of combinations is bounded
+    query = """SELECT * WHERE { ?x <http://example.org/p> ?y .
+        VALUES ?x { <http://example.org/a> <http://example.org/b> <http://example.org/c> }
+        VALUES ?y { <http://example.org/a> <http://example.org/b> <http://example.org/c> } }"""
+    max_values_combinations = request_processor.MAX_VALUES_COMBINATIONS
+    request_processor.MAX_VALUES_COMBINATIONS = 8
+    try:
+        prepare(query)
+        assert False
+    except Exception as e:
+        assert "more than 8 value combinations" in str(e)
+    finally:
+        request_processor.MAX_VALUES_COMBINATIONS = max_values_combinations
+    assert len(prepare(query).decomposition.values[0]) == 9
+    logger.info("VALUES combination test successful!\n")
+
+
+# Testing the conversion of filters into VALUES statements
+def test_add_values_from_filter():
+    a, b = "<http://example.org/a>", "<http://example.org/b>"
+    pattern = "?x <http://example.org/p> ?y"
+    # an equality with the IRI on either side
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?x = <http://example.org/a>) }").decomposition.values == [[{"x": a}]]
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(<http://example.org/a> = ?x) }").decomposition.values == [[{"x": a}]]
+    # a list of IRIs, of which duplicates are only sent once
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?x IN (<http://example.org/a>, <http://example.org/b>, <http://example.org/a>)) }").decomposition.values == [[{"x": a}, {"x": b}]]
+    # filters within a conjunction, whose values are combined
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?x = <http://example.org/a> && ?y IN (<http://example.org/a>, <http://example.org/b>)) }").decomposition.values == [[{"x": a, "y": a}, {"x": a, "y": b}]]
+    # literals, other operators, other variables and variables that are not in the main pattern are ignored
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?y = 1) }").decomposition.values == []
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?y IN (<http://example.org/a>, \"a\")) }").decomposition.values == []
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?x != <http://example.org/a>) }").decomposition.values == []
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?x = ?y) }").decomposition.values == []
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?z = <http://example.org/a>) }").decomposition.values == []
+    logger.info("Filter values test successful!\n")
+
+
+# Testing which queries are answered directly from the bindings of the knowledge network
+def test_derive_direct_result():
+    pattern = "?x <http://example.org/p> ?y"
+    # a projection, DISTINCT and LIMIT/OFFSET over a single graph pattern
+    direct_result = prepare("SELECT * WHERE { " + pattern + " }").direct_result
+    assert sorted(direct_result.vars) == ["x", "y"] and not direct_result.distinct
+    assert direct_result.offset == 0 and direct_result.limit is None
+    direct_result = prepare("SELECT DISTINCT ?x WHERE { " + pattern + " } LIMIT 5 OFFSET 2").direct_result
+    assert direct_result.vars == ["x"] and direct_result.distinct
+    assert direct_result.offset == 2 and direct_result.limit == 5
+    # other queries are evaluated locally
+    assert prepare("ASK WHERE { " + pattern + " }").direct_result is None
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?y > 1) }").direct_result is None
+    assert prepare("SELECT (COUNT(?x) AS ?n) WHERE { " + pattern + " }").direct_result is None
+    assert prepare("SELECT * WHERE { " + pattern + " OPTIONAL { ?y <http://example.org/q> ?z } }").direct_result is None
+    assert prepare("SELECT * WHERE { { " + pattern + " } UNION { ?x <http://example.org/q> ?y } }").direct_result is None
+    assert prepare("SELECT * WHERE { [] <http://example.org/p> ?y }").direct_result is None
+    logger.info("Direct result test successful!\n")
+
+
+# Testing the limit of the bindings that are needed for the slice of a query
+def test_derive_bindings_limit():
+    pattern = "?x <http://example.org/p> ?y"
+    # the bindings up to the end of the slice are needed
+    assert prepare("SELECT * WHERE { " + pattern + " } LIMIT 3").decomposition.bindingsLimit == 3
+    assert prepare("SELECT * WHERE { " + pattern + " OPTIONAL { ?y <http://example.org/q> ?z } } LIMIT 3 OFFSET 1").decomposition.bindingsLimit == 4
+    # all bindings are needed without a slice, or when solutions are filtered, aggregated, deduplicated or united
+    assert prepare("SELECT * WHERE { " + pattern + " }").decomposition.bindingsLimit is None
+    assert prepare("SELECT * WHERE { " + pattern + " FILTER(?y > 1) } LIMIT 3").decomposition.bindingsLimit is None
+    assert prepare("SELECT (COUNT(?x) AS ?n) WHERE { " + pattern + " } LIMIT 3").decomposition.bindingsLimit is None
+    assert prepare("SELECT DISTINCT * WHERE { " + pattern + " } LIMIT 3").decomposition.bindingsLimit is None
+    assert prepare("SELECT * WHERE { { " + pattern + " } UNION { ?x <http://example.org/q> ?y } } LIMIT 3").decomposition.bindingsLimit is None
+    # only distinct bindings up to the limit are kept
+    bindings = [{"x": "<http://example.org/a>"}, {"x": "<http://example.org/a>"}, {"x": "<http://example.org/b>"}, {"x": "<http://example.org/c>"}]
+    assert request_processor.limitBindings(bindings, 2) == [{"x": "<http://example.org/a>"}, {"x": "<http://example.org/b>"}]
+    logger.info("Bindings limit test successful!\n")
+
+
+# Testing the negotiation of the result format
+def test_negotiate_result_format():
+    formats = ["json", "csv", "tsv", "xml"]
+    assert result_writer.negotiateResultFormat("application/sparql-results+json", formats) == "json"
+    assert result_writer.negotiateResultFormat("text/csv", formats) == "csv"
+    assert result_writer.negotiateResultFormat("text/tab-separated-values", formats) == "tsv"
+    assert result_writer.negotiateResultFormat("application/sparql-results+xml", formats) == "xml"
+    # the format with the highest quality is chosen
+    assert result_writer.negotiateResultFormat("text/csv;q=0.5, application/sparql-results+xml;q=0.8", formats) == "xml"
+    assert result_writer.negotiateResultFormat("text/html, text/csv;q=0.1", formats) == "csv"
+    # any format prefers the first one
+    assert result_writer.negotiateResultFormat("*/*", formats) == "json"
+    assert result_writer.negotiateResultFormat("text/csv;q=0.5, */*;q=0.1", formats) == "csv"
+    # formats that are not offered, or not accepted, are not chosen
+    assert result_writer.negotiateResultFormat("text/csv", ["json"]) is None
+    assert result_writer.negotiateResultFormat("text/html", formats) is None
+    assert result_writer.negotiateResultFormat("text/csv;q=0", formats) is None
+    logger.info("Result format negotiation test successful!\n")
+
+
+# do the tests!
+try:
+    test_normalize_query_text()
+    test_join_values_statements()
+    test_add_values_from_filter()
+    test_derive_direct_result()
+    test_derive_bindings_limit()
+    test_negotiate_result_format()
+    logger.info(f"All tests were successful!!")
+except:
+    logger.info(f"The last test that was checked failed!!")
+    raise
@@ -0,0 +1,214 @@
+import os
+import sys
+import logging
+import time
+import asyncio
+import tempfile
+import subprocess
+import httpx
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from rdflib import URIRef, Variable
+from knowledge_mapper.tke_exceptions import UnexpectedHttpResponseError
+import knowledge_network
+from cache import LRUCache
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# ASSUMPTIONS:
+# - These tests check the state that the endpoint keeps about the knowledge network, where the knowledge network
+#   is replaced by a fake one in memory, but the environment variables for the knowledge network should still be set
+
+# When testing in terminal, add environment variables to the command:
+# KNOWLEDGE_ENGINE_URL=http://localhost:8280/rest KNOWLEDGE_BASE_ID_PREFIX=https://test-sparql-endpoint/ LOG_LEVEL=DEBUG python test_state.py
+
+class FakeKnowledgeEngine:
+    # keeps the knowledge bases and knowledge interactions in memory, where an ask fails when its knowledge interaction
+    # is no longer registered once the answer is ready
+    def __init__(self):
+        self.knowledge_bases = set()
+        self.knowledge_interactions = set()
+        self.failed_asks = 0
+
+    async def get_knowledge_base(self, kb_id):
+        return {"knowledgeBaseId": kb_id} if kb_id in self.knowledge_bases else None
+
+    async def register_knowledge_base(self, kb_id, name, description, reregister=False):
+        if kb_id in self.knowledge_bases:
+            return False
+        self.knowledge_bases.add(kb_id)
+        return True
+
+    async def unregister_knowledge_base(self, kb_id):
+        self.knowledge_bases.discard(kb_id)
+
+    async def register_knowledge_interaction(self, kb_id, req, name=None):
+        ki_id = f"{kb_id}/interaction/{name}"
+        self.knowledge_interactions.add(ki_id)
+        return ki_id
+
+    async def unregister_knowledge_interaction(self, kb_id, ki_id):
+        self.knowledge_interactions.discard(ki_id)
+
+    async def ask(self, kb_id, ki_id, bindings):
+        await asyncio.sleep(0.05)
+        if ki_id not in self.knowledge_interactions:
+            self.failed_asks += 1
+            raise UnexpectedHttpResponseError(httpx.Response(404, text="unknown knowledge interaction", request=httpx.Request("POST", "http://fake/sc/ask")))
+        return {"bindingSet": [{"o": "<http://example.org/o>"}]}
+
+
+# Testing that a knowledge interaction is not unregistered while an ask uses it
+def test_evict_knowledge_interaction_in_flight():
+    ke_client, cache_size = knowledge_network.ke_client, knowledge_network.KNOWLEDGE_INTERACTION_CACHE_SIZE
+    knowledge_network.ke_client = fake = FakeKnowledgeEngine()
+    knowledge_network.KNOWLEDGE_INTERACTION_CACHE_SIZE = 1
+    try:
+        async def ask_concurrently():
+            # the second ask evicts the knowledge interaction of the first one from the cache while the first one is asked
+            patterns = [[(Variable("s"), URIRef(f"http://example.org/p{i}"), Variable("o"))] for i in range(3)]
+            answers = await asyncio.gather(*[knowledge_network.askPatternAtKnowledgeNetwork("evicting-requester", pattern, [], False) for pattern in patterns])
+            # the evicted knowledge interactions are unregistered in the background after their ask
+            await asyncio.sleep(0.01)
+            return answers
+        answers = asyncio.run(ask_concurrently())
+        assert answers == [{"bindingSet": [{"o": "<http://example.org/o>"}]}]*3
+        assert fake.failed_asks == 0
+        # only the knowledge interaction that is still cached remains registered
+        assert len(fake.knowledge_interactions) == 1
+        assert not knowledge_network.knowledge_interaction_users and not knowledge_network.deferred_knowledge_interactions
+    finally:
+        knowledge_network.knowledge_bases.clear()
+        knowledge_network.knowledge_interactions.clear()
+        asyncio.run(knowledge_network.shared_state.clear())
+        knowledge_network.ke_client, knowledge_network.KNOWLEDGE_INTERACTION_CACHE_SIZE = ke_client, cache_size
+    logger.info("Knowledge interaction eviction test successful!\n")
+
+
+# Testing that a knowledge base is claimed by one worker, used by the others and unregistered by the last one
+def test_shared_knowledge_base():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.sqlite")
+        state = SharedState(path)
+        # another worker on the same node is simulated by an instance with the pid of a process that is alive
+        other = SharedState(path)
+        other.pid = os.getppid()
+        other.join_workers()
+        async def share():
+            assert await state.claim_knowledge_base("kb") == "claimed"
+            assert await other.claim_knowledge_base("kb") == "registering"
+            await state.complete_knowledge_base("kb")
+            assert await other.claim_knowledge_base("kb") == "registered"
+            assert await state.put_knowledge_interaction("kb", ["ask", "p"], "ki-1") == "ki-1"
+            assert await other.put_knowledge_interaction("kb", ["ask", "p"], "ki-2") == "ki-1"
+            assert await other.get_knowledge_interaction("kb", ["ask", "p"]) == "ki-1"
+            # the first worker that leaves keeps the knowledge base registered for the other one
+            assert not await state.leave_knowledge_base("kb")
+            assert await other.leave_knowledge_base("kb")
+            assert await other.get_knowledge_interaction("kb", ["ask", "p"]) is None
+            assert await state.claim_knowledge_base("kb") == "unregistering"
+            # only the worker that unregisters the knowledge base completes its unregistration
+            await state.complete_unregistration("kb")
+            assert await other.knowledge_base_ids() == ["kb"]
+            await other.complete_unregistration("kb")
+            assert await state.knowledge_base_ids() == []
+            assert not await other.leave_workers()
+            assert await state.leave_workers()
+        asyncio.run(share())
+    logger.info("Shared knowledge base test successful!\n")
+
+
+# Testing that a claim that is not completed in time, or of a worker that is gone, is taken over
+def test_stale_knowledge_base_claim():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.sqlite")
+        state = SharedState(path, stale_after=0.1)
+        other = SharedState(path, stale_after=0.1)
+        other.pid = os.getppid()
+        other.join_workers()
+        gone = subprocess.Popen([sys.executable, "-c", "pass"])
+        gone.wait()
+        async def take_over():
+            assert await other.claim_knowledge_base("kb") == "claimed"
+            assert await state.claim_knowledge_base("kb") == "registering"
+            await asyncio.sleep(0.2)
+            assert await state.claim_knowledge_base("kb") == "claimed"
+            await state.complete_knowledge_base("kb")
+            # a registered knowledge base is never stale
+            await asyncio.sleep(0.2)
+            assert await other.claim_knowledge_base("kb") == "registered"
+            assert not await other.leave_knowledge_base("kb")
+            # a user of the knowledge base that is gone does not keep it registered
+            other.pid = gone.pid
+            await other.complete_knowledge_base("kb")
+            assert await state.leave_knowledge_base("kb")
+            await state.complete_unregistration("kb")
+            # a knowledge base that is unknown at the knowledge network is claimed again
+            assert await state.claim_knowledge_base("kb") == "claimed"
+            await state.complete_knowledge_base("kb")
+            await state.release_unknown_knowledge_base("kb")
+            assert await state.claim_knowledge_base("kb") == "claimed"
+            await state.release_knowledge_base("kb")
+            assert await state.knowledge_base_ids() == []
+        asyncio.run(take_over())
+    logger.info("Stale knowledge base claim test successful!\n")
+
+
+# Testing that the cache evicts its least recently used entries by size, weight and time-to-live
+def test_lru_cache():
+    evicted = []
+    cache = LRUCache(2, on_evict=lambda key, value: evicted.append(key))
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert evicted == ["b"] and "b" not in cache
+    # a live value is kept, unless it is replaced
+    assert cache.put("a", 10) == 1
+    assert cache.put("a", 10, replace=True) == 10
+    assert evicted == ["b", "a"]
+    # popping and clearing do not call on_evict
+    assert cache.pop("a") == 10
+    cache.clear()
+    assert evicted == ["b", "a"] and len(cache) == 0
+
+    cache = LRUCache(10, on_evict=lambda key, value: evicted.append(key), max_weight=10, weigh=len)
+    cache.put("d", "12345")
+    cache.put("e", "1234")
+    cache.put("f", "123")
+    assert evicted[-1] == "d" and cache.weight == 7
+    # a value that is heavier than the cache on its own is not cached
+    assert cache.put("g", "12345678901") == "12345678901"
+    assert "g" not in cache and cache.weight == 7
+
+    cache = LRUCache(10, ttl=0.1, on_evict=lambda key, value: evicted.append(key))
+    cache.put("h", 1)
+    cache.put("i", 2)
+    time.sleep(0.2)
+    assert cache.get("h") is None and evicted[-1] == "h"
+    assert cache.expire() == [("i", 2)] and evicted[-1] == "i"
+    cache = LRUCache(10, ttl=0.2, sliding=True)
+    cache.put("j", 1)
+    time.sleep(0.12)
+    assert cache.get("j") == 1
+    time.sleep(0.12)
+    assert cache.get("j") == 1
+    assert cache.stats()["hits"] == 2
+    logger.info("LRU cache test successful!\n")
+
+
+# do the tests!
+try:
+    test_shared_knowledge_base()
+    test_stale_knowledge_base_claim()
+    test_lru_cache()
+    test_evict_knowledge_interaction_in_flight()
+    logger.info(f"All tests were successful!!")
+except:
+    logger.info(f"The last test that was checked failed!!")
+    raise
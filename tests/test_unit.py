@@ -3,6 +3,7 @@ import sys
 import json
 import logging
 import time
+import asyncio
 from urllib.parse import quote
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -33,6 +34,14 @@ def test_root():
     logger.info("Root test successful!\n")
 
 
+# Testing readiness
+def test_ready():
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json() == "App is ready."
+    logger.info("Readiness test successful!\n")
+
+
 # Testing correct token handling for each route
 def test_check_token_for_each_route():
     logger.info("Now checking correct token handling for each route!")
@@ -58,7 +67,7 @@ def test_get_query_URL_encoded_as_parameter_without_token():
     headers = {"Accept": "application/javascript"}
     response = client.get("/query/", params=params, headers=headers)
     assert response.status_code == 412
-    assert response.json()['detail'] == "When you provide the 'Accept' header, it should contain 'application/json' or 'application/sparql-results+json' as the endpoint only returns JSON output!"
+    assert response.json()['detail'] == "When you provide the 'Accept' header, it should contain 'application/json', 'application/sparql-results+json', 'text/csv', 'text/tab-separated-values' or 'application/sparql-results+xml'!"
     logger.info("\n")
 
     # check exception of the Content-Type header
@@ -116,6 +125,55 @@ def test_get_query_URL_encoded_as_parameter_without_token():
     assert value.endswith("FirstLandingOnTheMoon") or value.endswith("IntroductionOfTheEuro") or value.endswith("BiggestClimateStrikes")
     logger.info("\n")
 
+    # check query with BGP that should give correct results in CSV format
+    query = "SELECT * WHERE { ?event <http://example.org/hasOccurredAt> ?datetime . }"
+    params = {"query": query}
+    response = client.get("/query/", params=params, headers={"Accept": "text/csv"})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("text/csv")
+    rows = response.text.splitlines()
+    assert sorted(rows[0].split(",")) == ["datetime", "event"]
+    assert len(rows) == 4
+    logger.info("\n")
+
+    # check query with BGP that should give correct results in TSV format
+    query = "SELECT * WHERE { ?event <http://example.org/hasOccurredAt> ?datetime . }"
+    params = {"query": query}
+    response = client.get("/query/", params=params, headers={"Accept": "text/tab-separated-values"})
+    assert response.status_code == 200
+    rows = response.text.splitlines()
+    assert sorted(rows[0].split("\t")) == ["?datetime", "?event"]
+    assert "<http://example.org/" in rows[1]
+    logger.info("\n")
+
+    # check query with BGP that should give correct results in XML format
+    query = "SELECT * WHERE { ?event <http://example.org/hasOccurredAt> ?datetime . }"
+    params = {"query": query}
+    response = client.get("/query/", params=params, headers={"Accept": "application/sparql-results+xml"})
+    assert response.status_code == 200
+    assert '<variable name="event"/>' in response.text
+    assert response.text.count("<result>") == 3
+    logger.info("\n")
+
+    # check query with BGP that should give its profile next to the results
+    query = "SELECT * WHERE { ?event <http://example.org/hasOccurredAt> ?datetime . }"
+    params = {"query": query, "profile": "true"}
+    response = client.get("/query/", params=params, headers={"Accept": "application/json"})
+    assert response.status_code == 200
+    assert len(response.json()['results']['bindings']) == 3
+    assert response.json()['profile']['decomposition']['mainPattern'] == ["?event <http://example.org/hasOccurredAt> ?datetime"]
+    assert response.json()['profile']['asks'][0]['bindings_out'] == 3
+    assert response.json()['profile']['asks'][0]['bindings'] == "[{}]"
+    logger.info("\n")
+
+    # check query with BGP that should not give its profile in CSV format
+    query = "SELECT * WHERE { ?event <http://example.org/hasOccurredAt> ?datetime . }"
+    params = {"query": query, "profile": "true"}
+    response = client.get("/query/", params=params, headers={"Accept": "text/csv"})
+    assert response.status_code == 400
+    assert response.json()['detail'] == "You can only ask for the profile of a query with 'profile=true' when the result is returned in JSON!"
+    logger.info("\n")
+
     # check query with FILTER that should give correct results 
     query = """PREFIX ex: <http://example.org/>
                SELECT * WHERE {
@@ -325,7 +383,7 @@ def test_post_query_unencoded_in_body_without_token():
     headers = {"Accept": "application/javascript"}
     response = client.post("/query/", data=query, headers=headers)
     assert response.status_code == 412
-    assert response.json()['detail'] == "When you provide the 'Accept' header, it should contain 'application/json' or 'application/sparql-results+json' as the endpoint only returns JSON output!"
+    assert response.json()['detail'] == "When you provide the 'Accept' header, it should contain 'application/json', 'application/sparql-results+json', 'text/csv', 'text/tab-separated-values' or 'application/sparql-results+xml'!"
     logger.info("\n")
 
     # check exception of the presence of a Content-Type header
@@ -587,7 +645,7 @@ def test_post_query_URL_encoded_in_body_without_token():
     headers = {"Accept": "application/javascript"}
     response = client.post("/query/", data=payload, headers=headers)
     assert response.status_code == 412
-    assert response.json()['detail'] == "When you provide the 'Accept' header, it should contain 'application/json' or 'application/sparql-results+json' as the endpoint only returns JSON output!"
+    assert response.json()['detail'] == "When you provide the 'Accept' header, it should contain 'application/json', 'application/sparql-results+json', 'text/csv', 'text/tab-separated-values' or 'application/sparql-results+xml'!"
     logger.info("\n")
 
     # check exception of the presence of a Content-Type header
@@ -1201,6 +1259,7 @@ def test_post_update_unencoded_in_body_without_token():
 # do the tests!
 try:
     test_root()
+    test_ready()
     test_check_token_for_each_route()
     test_get_query_URL_encoded_as_parameter_without_token()
     test_post_query_unencoded_in_body_without_token()
@@ -1212,5 +1271,5 @@ except:
     logger.info(f"The last test that was checked failed!!")
 
 # unregister the knowledge bases to clean up properly
-knowledge_network.unregisterKnowledgeBases()
+asyncio.run(knowledge_network.unregisterKnowledgeBases())
 
@@ -77,6 +77,14 @@ def check_token_and_get_requester_id(request: Request) -> str:
     return requester_id
 
 
+def get_requester_ids() -> list:
+    # all requesters that are known to the endpoint, e.g. to register their knowledge bases upfront
+    if TOKEN_ENABLED:
+        return list(dict.fromkeys(token_to_requestor_id_mapping.values()))
+    else: # no token is needed and thus the only requester is simply "requester"
+        return ["requester"]
+
+
 def validate_token(token:str) -> str:
     # TODO: get this ID from a mapping from token to requester ID, provided by a Trusted Third Party that guarantees that the ID is trusted 
     if token in token_to_requestor_id_mapping.keys():